@@ -1,4 +1,4 @@
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from fastapi import APIRouter, BackgroundTasks
 
@@ -24,3 +24,26 @@ async def process_devices(background_tasks: BackgroundTasks) -> Dict[str, Any]:
         "status": "processing",
         "message": "Device processing started in the background",
     }
+
+
+@router.get("/generations")
+async def list_generations() -> Dict[str, Any]:
+    """
+    List generations
+
+    Returns the kept generations of Telegraf configurations and Grafana
+    dashboards, oldest first, and the one that is currently live.
+    """
+    return await DeviceService.list_generations()
+
+
+@router.post("/rollback")
+async def rollback(generation: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Roll back to a previous generation
+
+    Makes the given generation live again, or the one before the live
+    generation if none is given. The next processing run builds on it.
+    """
+    generation = await DeviceService.rollback(generation)
+    return {"status": "rolled_back", "generation": generation}
@@ -2,6 +2,8 @@ from typing import Any, Dict
 
 from fastapi import APIRouter
 
+from app.core.http_pool import http_pool
+
 router = APIRouter()
 
 
@@ -13,3 +15,13 @@ async def health_check() -> Dict[str, Any]:
     Returns the status of the API Monitor service.
     """
     return {"status": "healthy", "service": "api-monitor"}
+
+
+@router.get("/http-pool")
+async def http_pool_stats() -> Dict[str, Any]:
+    """
+    Connection pool statistics
+
+    Returns hit/miss counters of the shared HTTP connection pool.
+    """
+    return http_pool.stats()
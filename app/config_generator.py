@@ -2,46 +2,59 @@
 import logging
 import os
 
-import jinja2
+from app.core.metric_names import tag_key
+from app.core.polled_endpoints import polled_endpoints
+from app.core.templates import get_template
+from app.core.token_files import telegraf_token_file_path
 
 logger = logging.getLogger("api-monitor.config-generator")
 
 
 class TelegrafConfigGenerator:
-    def __init__(self, device_config, api_structure):
-        self.device_config = device_config
+    def __init__(self, device, api_structure):
+        self.device = device
         self.api_structure = api_structure
-        self.template_loader = jinja2.FileSystemLoader(
-            searchpath=os.path.join(os.path.dirname(__file__), "templates")
-        )
-        self.template_env = jinja2.Environment(loader=self.template_loader)
 
     def generate(self):
         """Generate Telegraf configuration for the device"""
-        device_type = self.device_config.get("type", "generic")
-        device_name = self.device_config.get("name", "unknown")
+        device_type = self.device.type
+        device_name = self.device.name
 
-        # Try to find a template for this device type
-        try:
-            template = self.template_env.get_template(f"telegraf_{device_type}.conf.j2")
-        except jinja2.exceptions.TemplateNotFound:
-            # Fallback to generic template
-            template = self.template_env.get_template("telegraf_generic.conf.j2")
+        # Use the template for this device type, or the generic one
+        template = get_template("telegraf", device_type, "conf")
 
         # Check if auth failed and log it
-        if self.device_config.get("auth_failed", False):
+        if self.device.auth_failed:
             logger.warning(
-                f"Generating limited configuration for {device_name} due to auth failure: {self.device_config.get('auth_error', 'Unknown error')}"
+                f"Generating limited configuration for {device_name} due to auth failure: {self.device.auth_error or 'Unknown error'}"
             )
 
+        endpoints = polled_endpoints(self.device, self.api_structure)
+
         # Prepare template variables - ensure global is included properly
         template_vars = {
-            "device": self.device_config,
+            "device": self.device,
             "api": self.api_structure,
-            # Get global from device_config if available, otherwise provide an empty dict
-            "global": self.device_config.get("global", {}),
-            "auth_failed": self.device_config.get("auth_failed", False),
-            "auth_error": self.device_config.get("auth_error", None),
+            "global": self.device.global_config,
+            "auth_failed": self.device.auth_failed,
+            "auth_error": self.device.auth_error,
+            "polled_endpoints": endpoints,
+            # URL Telegraf polls for each endpoint, joined as discovery does
+            "endpoint_urls": {
+                endpoint["path"]: self._endpoint_url(endpoint)
+                for endpoint in endpoints
+            },
+            # Tags identifying the series of each polled endpoint, by path
+            "tag_keys": {
+                endpoint["path"]: self._tag_keys(endpoint)
+                for endpoint in endpoints
+            },
+            # Token file Telegraf reads on every request, renewed by the token broker
+            "token_file": (
+                telegraf_token_file_path(device_name)
+                if self.device.api.auth_type == "token_from_auth"
+                else None
+            ),
         }
 
         # Render the template
@@ -55,6 +68,21 @@ class TelegrafConfigGenerator:
             # Generate a minimal configuration that won't break Telegraf
             return self._generate_minimal_config(device_name, device_type)
 
+    def _endpoint_url(self, endpoint):
+        """Get the URL of an endpoint on the device"""
+        base_url = self.device.api.base_url
+        return f"{base_url.rstrip('/')}/{endpoint['path'].lstrip('/')}"
+
+    @staticmethod
+    def _tag_keys(endpoint):
+        """Get the keys Telegraf reads as tags from an endpoint's response"""
+        keys = []
+        for tag in endpoint.get("tags", []):
+            key = tag_key(tag["path"])
+            if key is not None and key not in keys:
+                keys.append(key)
+        return keys
+
     def _generate_minimal_config(self, device_name, device_type):
         """Generate a minimal working configuration when template rendering fails"""
         minimal_config = f"""# Minimal configuration for {device_name} due to error
@@ -80,14 +108,12 @@ class TelegrafConfigGenerator:
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
         # Check if we're saving to a separate file or to the main config
-        if self.device_config["name"] + ".conf" in filename:
+        if self.device.name + ".conf" in filename:
             # For device-specific configs, always write a new file
             with open(filename, "w") as f:
                 f.write(self.generate())
 
-            logger.info(
-                f"Saved configuration for {self.device_config['name']} to {filename}"
-            )
+            logger.info(f"Saved configuration for {self.device.name} to {filename}")
         else:
             # For the main config, just write it as is
             with open(filename, "w") as f:
@@ -0,0 +1,401 @@
+import asyncio
+import codecs
+import hashlib
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple
+
+import httpx
+
+from app.core.config import settings
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?")
+_NUMBER_TAIL = re.compile(r"[0-9.eE+-]*")
+_LITERALS = {"t": ("true", True), "f": ("false", False), "n": ("null", None)}
+
+# Parser states
+_VALUE = 0  # expecting a value
+_ARRAY_FIRST = 1  # after "[", expecting a value or "]"
+_OBJECT_FIRST = 2  # after "{", expecting a key or "}"
+_KEY = 3  # after "," in an object, expecting a key
+_COLON = 4  # after a key, expecting ":"
+_AFTER_VALUE = 5  # expecting "," or a closing bracket
+
+_MISSING = object()
+
+# Strings from this length on are told apart from short ones in the shape
+# of a document, as the structure analyzer does not treat them as tags
+SHORT_STRING_LENGTH = 80
+
+
+class JsonLimitExceeded(ValueError):
+    """Raised when a JSON document exceeds its configured limits"""
+
+
+@dataclass(frozen=True)
+class JsonLimits:
+    """Byte, nesting depth and node count limits for a JSON document"""
+
+    max_bytes: int
+    max_depth: int
+    max_nodes: int
+
+    @classmethod
+    def for_samples(cls) -> "JsonLimits":
+        """Limits applied to sampled endpoint responses"""
+        return cls(
+            settings.json_max_bytes, settings.json_max_depth, settings.json_max_nodes
+        )
+
+    @classmethod
+    def for_specs(cls) -> "JsonLimits":
+        """Limits applied to OpenAPI/Swagger documents"""
+        return cls(
+            settings.spec_max_bytes, settings.json_max_depth, settings.spec_max_nodes
+        )
+
+
+class BoundedJsonParser:
+    """
+    Incremental JSON parser with depth and node-count limits
+
+    Text is fed in chunks as it arrives. Containers nested deeper than
+    max_depth are dropped, and parsing stops once max_nodes values have
+    been seen, leaving the partial document built so far. A document cut
+    short by the byte limit is closed the same way.
+
+    The shape of the kept document, its keys and value kinds without the
+    values, is recorded as it is parsed, so documents can be told apart by
+    structure without walking them again.
+    """
+
+    def __init__(self, limits: JsonLimits):
+        self.limits = limits
+        self.nodes = 0
+        self.truncated = False
+        self.done = False
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._buffer = ""
+        self._pos = 0
+        # How far an unterminated string has been scanned, relative to its start
+        self._string_scanned = 0
+        # Frames are [container, is_dict, pending_key, kept]
+        self._stack: List[list] = []
+        self._state = _VALUE
+        self._root: Any = _MISSING
+        self._complete = False
+        self._shape: List[str] = []
+
+    def feed(self, data: bytes) -> None:
+        """Feed the next chunk of the document"""
+        if self.done:
+            return
+        self._buffer = self._buffer[self._pos :] + self._decoder.decode(data)
+        self._pos = 0
+        self._parse(final=False)
+
+    def finish(self, partial: bool = False) -> Any:
+        """
+        Finish parsing and return the (possibly partial) document
+
+        Set partial when the input was cut short on purpose, so open
+        containers are closed instead of treated as an error.
+        """
+        if partial:
+            self.truncated = True
+        elif not self.done:
+            self._buffer = self._buffer[self._pos :] + self._decoder.decode(
+                b"", final=True
+            )
+            self._pos = 0
+            self._parse(final=True)
+
+        if not self._complete and not (partial or self.done):
+            self._error("Unexpected end of JSON document")
+        if self._root is _MISSING:
+            self._error("Expecting value")
+        return self._root
+
+    def fingerprint(self) -> str:
+        """Hash the shape of the document parsed so far"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("".join(self._shape).encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def _error(self, message: str) -> None:
+        raise json.JSONDecodeError(message, self._buffer, self._pos)
+
+    def _parse(self, final: bool) -> None:
+        buffer = self._buffer
+        end = len(buffer)
+
+        while not self.done:
+            pos = _WHITESPACE.match(buffer, self._pos).end()
+            self._pos = pos
+            if pos >= end:
+                return
+
+            char = buffer[pos]
+            state = self._state
+
+            if state == _VALUE or state == _ARRAY_FIRST:
+                if char == "]" and state == _ARRAY_FIRST:
+                    self._close(pos + 1)
+                elif char == "{":
+                    self._open({}, True, pos + 1)
+                elif char == "[":
+                    self._open([], False, pos + 1)
+                elif char == '"':
+                    string_end = self._find_string_end(buffer, pos, final)
+                    if string_end < 0:
+                        return
+                    self._add(self._decode_string(buffer, pos, string_end), string_end)
+                elif char == "-" or char.isdigit():
+                    match = _NUMBER.match(buffer, pos)
+                    if match is None:
+                        if final or end - pos > 1:
+                            self._error("Invalid number")
+                        return
+                    if (
+                        not final
+                        and _NUMBER_TAIL.match(buffer, match.end()).end() == end
+                    ):
+                        # The number may continue in the next chunk
+                        return
+                    token = match.group()
+                    value = (
+                        float(token)
+                        if "." in token or "e" in token or "E" in token
+                        else int(token)
+                    )
+                    self._add(value, match.end())
+                elif char in _LITERALS:
+                    literal, value = _LITERALS[char]
+                    if buffer.startswith(literal, pos):
+                        self._add(value, pos + len(literal))
+                    elif (
+                        not final
+                        and end - pos < len(literal)
+                        and literal.startswith(buffer[pos:])
+                    ):
+                        return
+                    else:
+                        self._error("Expecting value")
+                else:
+                    self._error("Expecting value")
+
+            elif state == _OBJECT_FIRST or state == _KEY:
+                if char == "}" and state == _OBJECT_FIRST:
+                    self._close(pos + 1)
+                elif char == '"':
+                    string_end = self._find_string_end(buffer, pos, final)
+                    if string_end < 0:
+                        return
+                    self._stack[-1][2] = self._decode_string(buffer, pos, string_end)
+                    self._state = _COLON
+                    self._pos = string_end
+                else:
+                    self._error("Expecting property name enclosed in double quotes")
+
+            elif state == _COLON:
+                if char != ":":
+                    self._error("Expecting ':' delimiter")
+                self._state = _VALUE
+                self._pos = pos + 1
+
+            else:  # _AFTER_VALUE
+                if not self._stack:
+                    self._error("Extra data")
+                is_dict = self._stack[-1][1]
+                if char == ",":
+                    self._state = _KEY if is_dict else _VALUE
+                    self._pos = pos + 1
+                elif char == ("}" if is_dict else "]"):
+                    self._close(pos + 1)
+                else:
+                    self._error("Expecting ',' delimiter")
+
+    def _find_string_end(self, buffer: str, start: int, final: bool) -> int:
+        """Find the end of the string starting at start, or -1 if incomplete"""
+        index = start + max(1, self._string_scanned)
+        while True:
+            quote = buffer.find('"', index)
+            if quote < 0:
+                if final:
+                    self._error("Unterminated string")
+                # Resume scanning here once more data arrives
+                self._string_scanned = len(buffer) - start
+                return -1
+            backslash = quote - 1
+            while buffer[backslash] == "\\":
+                backslash -= 1
+            if (quote - backslash) % 2 == 1:
+                self._string_scanned = 0
+                return quote + 1
+            index = quote + 1
+
+    @staticmethod
+    def _decode_string(buffer: str, start: int, end: int) -> str:
+        token = buffer[start:end]
+        if "\\" not in token:
+            return token[1:-1]
+        return json.loads(token, strict=False)
+
+    def _count_node(self) -> None:
+        """Count a kept node, stopping the parser at the node limit"""
+        self.nodes += 1
+        if self.nodes >= self.limits.max_nodes:
+            self.done = True
+            self.truncated = True
+
+    def _attach(self, value: Any) -> bool:
+        """Attach a value to the open container, returning whether it is kept"""
+        if not self._stack:
+            self._root = value
+            return True
+
+        container, is_dict, key, kept = self._stack[-1]
+        if not kept:
+            return False
+        if is_dict:
+            container[key] = value
+            self._shape.append(f"{len(key)}:{key}")
+        else:
+            container.append(value)
+        return True
+
+    def _add(self, value: Any, pos: int) -> None:
+        self._pos = pos
+        self._state = _AFTER_VALUE
+        if self._attach(value):
+            self._shape.append(_shape_kind(value))
+            self._count_node()
+        if not self._stack:
+            self._complete = True
+
+    def _open(self, container: Any, is_dict: bool, pos: int) -> None:
+        self._pos = pos
+        self._state = _OBJECT_FIRST if is_dict else _ARRAY_FIRST
+
+        # Containers nested beyond max_depth are parsed but dropped
+        kept = len(self._stack) < self.limits.max_depth and self._attach(container)
+        if len(self._stack) >= self.limits.max_depth:
+            self.truncated = True
+        self._stack.append([container, is_dict, None, kept])
+        if kept:
+            self._shape.append("{" if is_dict else "[")
+            self._count_node()
+
+    def _close(self, pos: int) -> None:
+        self._pos = pos
+        self._state = _AFTER_VALUE
+        _, is_dict, _, kept = self._stack.pop()
+        if kept:
+            self._shape.append("}" if is_dict else "]")
+        if not self._stack:
+            self._complete = True
+
+
+def _shape_kind(value: Any) -> str:
+    """Classify a scalar for the shape of a document"""
+    if isinstance(value, str):
+        return "s" if len(value) < SHORT_STRING_LENGTH else "S"
+    if isinstance(value, bool):
+        return "b"
+    if isinstance(value, int):
+        return "i"
+    if isinstance(value, float):
+        return "f"
+    return "n"
+
+
+async def read_json(
+    response: httpx.Response, limits: JsonLimits
+) -> Tuple[Any, bool, Optional[str]]:
+    """
+    Read and parse a streamed JSON response within the given limits
+
+    The body is read up to the byte limit. A complete body within the
+    depth and node limits is parsed with the C json module, in a worker
+    thread to keep the event loop free. Bodies cut short by the byte limit,
+    or beyond the other limits, go through BoundedJsonParser to keep the
+    partial document. Returns the parsed document, whether it was
+    truncated, and the fingerprint of its shape when the incremental
+    parser recorded one.
+    """
+    body = bytearray()
+    partial = False
+
+    async for chunk in response.aiter_bytes():
+        remaining = limits.max_bytes - len(body)
+        if len(chunk) > remaining:
+            body += chunk[:remaining]
+            partial = True
+            break
+        body += chunk
+
+    if not partial:
+        try:
+            document = await asyncio.to_thread(load_document, bytes(body), limits)
+            return document, False, None
+        except (JsonLimitExceeded, UnicodeDecodeError):
+            pass
+    return await asyncio.to_thread(_parse_bounded, bytes(body), limits, partial)
+
+
+def _parse_bounded(
+    body: bytes, limits: JsonLimits, partial: bool
+) -> Tuple[Any, bool, str]:
+    """Parse a body with BoundedJsonParser, keeping what fits the limits"""
+    parser = BoundedJsonParser(limits)
+    parser.feed(body)
+    document = parser.finish(partial=partial)
+    return document, parser.truncated, parser.fingerprint()
+
+
+async def read_body(response: httpx.Response, max_bytes: int) -> bytes:
+    """Read a streamed, decompressed response body up to max_bytes"""
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) > max_bytes:
+            raise JsonLimitExceeded(f"Response body exceeds {max_bytes} bytes")
+    return bytes(body)
+
+
+def load_document(body: bytes, limits: JsonLimits) -> Any:
+    """Parse a complete JSON document, rejecting it if it exceeds the limits"""
+    if len(body) > limits.max_bytes:
+        raise JsonLimitExceeded(f"Document exceeds {limits.max_bytes} bytes")
+    try:
+        document = json.loads(body)
+    except RecursionError:
+        raise JsonLimitExceeded("Document is nested too deeply")
+
+    error = _check_limits(document, limits)
+    if error is not None:
+        raise JsonLimitExceeded(error)
+    return document
+
+
+def _check_limits(document: Any, limits: JsonLimits) -> Optional[str]:
+    """Check a parsed document against the depth and node limits"""
+    nodes = 0
+    stack = [(document, 0)]
+    while stack:
+        value, depth = stack.pop()
+        nodes += 1
+        if nodes > limits.max_nodes:
+            return f"Document exceeds {limits.max_nodes} nodes"
+        if isinstance(value, dict):
+            children = value.values()
+        elif isinstance(value, list):
+            children = value
+        else:
+            continue
+        if depth >= limits.max_depth:
+            return f"Document exceeds depth {limits.max_depth}"
+        stack.extend((child, depth + 1) for child in children)
+    return None
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.device_model import Device
+
+logger = logging.getLogger("api-monitor.build-manifest")
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Files whose content shapes the generated outputs
+GENERATOR_SOURCES = (
+    "config_generator.py",
+    "dashboard_generator.py",
+    "rules_generator.py",
+    os.path.join("core", "metric_names.py"),
+    os.path.join("core", "polled_endpoints.py"),
+)
+
+# Parts of api_structure no generator reads: the raw samples and counts
+# that change with the length of arrays in the sampled responses
+_UNUSED_STRUCTURE_KEYS = ("samples", "summary")
+_UNUSED_DESCRIPTOR_KEYS = ("occurrences", "samples", "type_conflicts")
+
+# (mtime/size of each source, combined hash)
+_sources: Optional[Tuple[Tuple[Tuple[str, float, int], ...], str]] = None
+
+
+class BuildManifest:
+    """
+    Record of the inputs each device's outputs were generated from
+
+    A device's fingerprint covers its configuration, the parts of the
+    discovered api_structure the generators read, the template and generator
+    files and the global settings. Every generation stores the manifest of
+    the outputs it holds, so a device whose fingerprint matches the live
+    generation can carry its outputs forward instead of being rendered
+    and written again.
+    """
+
+    # Bump when the fingerprint inputs change
+    FORMAT_VERSION = 1
+    FILENAME = "manifest.json"
+
+    def __init__(self, entries: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, directory: Optional[str]) -> "BuildManifest":
+        """Load the manifest stored in a generation directory"""
+        if directory is None:
+            return cls()
+        path = os.path.join(directory, cls.FILENAME)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == cls.FORMAT_VERSION:
+                return cls(data.get("devices", {}))
+        except Exception as e:
+            logger.error(f"Error loading build manifest from {path}: {str(e)}")
+        return cls()
+
+    def save(self, directory: str) -> None:
+        """Write the manifest into a generation directory"""
+        with open(os.path.join(directory, self.FILENAME), "w") as f:
+            json.dump({"version": self.FORMAT_VERSION, "devices": self.entries}, f)
+
+    @staticmethod
+    def fingerprint(device: Device, api_structure: Dict[str, Any]) -> str:
+        """Hash every input the generated outputs of a device depend on"""
+        structure = {
+            key: value
+            for key, value in api_structure.items()
+            if key not in _UNUSED_STRUCTURE_KEYS
+        }
+        structure["endpoints"] = [
+            _endpoint_inputs(endpoint) for endpoint in structure.get("endpoints", [])
+        ]
+        inputs = {
+            "version": BuildManifest.FORMAT_VERSION,
+            "device": device.model_dump(mode="json", by_alias=True),
+            "api": structure,
+            "sources": _sources_hash(),
+            "settings": settings.model_dump(),
+        }
+        encoded = json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def is_current(self, device_name: str, fingerprint: str) -> bool:
+        """Check whether a device's outputs were generated from these inputs"""
+        entry = self.entries.get(device_name)
+        return entry is not None and entry.get("fingerprint") == fingerprint
+
+    def outputs(self, device_name: str) -> Dict[str, str]:
+        """Get the outputs of a device, as relative paths per output kind"""
+        entry = self.entries.get(device_name)
+        return dict(entry.get("outputs", {})) if entry else {}
+
+    def record(
+        self,
+        device_name: str,
+        fingerprint: Optional[str],
+        outputs: Dict[str, str],
+        dashboard: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Record the inputs and outputs of a device's generated files
+
+        dashboard keeps the device type and metrics the dashboards of its
+        type are built from, so they are kept when the device is skipped.
+        """
+        entry = {"fingerprint": fingerprint, "outputs": outputs}
+        if dashboard is not None:
+            entry["dashboard"] = dashboard
+        self.entries[device_name] = entry
+
+    def dashboards(self) -> Dict[str, Dict[str, Any]]:
+        """Get the dashboard details of the recorded devices"""
+        return {
+            device_name: entry["dashboard"]
+            for device_name, entry in self.entries.items()
+            if "dashboard" in entry
+        }
+
+
+def _endpoint_inputs(endpoint: Dict[str, Any]) -> Dict[str, Any]:
+    """Get an endpoint without the sample counts of its metrics and tags"""
+    inputs = dict(endpoint)
+    for key in ("metrics", "tags"):
+        if key in inputs:
+            inputs[key] = _descriptor_inputs(inputs[key])
+    if "jsonv2_config" in inputs:
+        inputs["jsonv2_config"] = {
+            key: _descriptor_inputs(value)
+            for key, value in inputs["jsonv2_config"].items()
+        }
+    return inputs
+
+
+def _descriptor_inputs(descriptors: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            name: value
+            for name, value in descriptor.items()
+            if name not in _UNUSED_DESCRIPTOR_KEYS
+        }
+        for descriptor in descriptors
+    ]
+
+
+def _sources_hash() -> str:
+    """Hash the templates and generators, rehashing only when they change"""
+    global _sources
+
+    paths = [os.path.join(APP_DIR, name) for name in GENERATOR_SOURCES]
+    templates_dir = os.path.join(APP_DIR, "templates")
+    if os.path.isdir(templates_dir):
+        paths.extend(
+            os.path.join(templates_dir, name)
+            for name in sorted(os.listdir(templates_dir))
+        )
+
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats.append((path, stat.st_mtime, stat.st_size))
+        except OSError:
+            continue
+    stats = tuple(stats)
+
+    if _sources is None or _sources[0] != stats:
+        digest = hashlib.sha256()
+        for path, _, _ in stats:
+            digest.update(os.path.basename(path).encode("utf-8") + b"\x00")
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        _sources = (stats, digest.hexdigest())
+    return _sources[1]
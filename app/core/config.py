@@ -9,17 +9,100 @@ class Settings(BaseModel):
 
     # Paths
     config_path: str = os.environ.get("CONFIG_PATH", "/config/devices.yml")
+    # Directory of YAML fragments merged into the device configuration
+    devices_dir: str = os.environ.get(
+        "DEVICES_DIR",
+        os.path.join(
+            os.path.dirname(os.environ.get("CONFIG_PATH", "/config/devices.yml")),
+            "devices.d",
+        ),
+    )
     telegraf_dir: str = os.environ.get("TELEGRAF_DIR", "/config/telegraf")
     grafana_dir: str = os.environ.get(
         "GRAFANA_DIR", "/config/grafana/provisioning/dashboards"
     )
-    token_env_path: str = os.environ.get(
-        "TOKEN_ENV_PATH", "/config/telegraf/auth_tokens.env"
+    token_dir: str = os.environ.get(
+        "TOKEN_DIR",
+        os.path.join(os.environ.get("TELEGRAF_DIR", "/config/telegraf"), "tokens"),
+    )
+    # The token directory as mounted in the Telegraf container
+    telegraf_token_dir: str = os.environ.get(
+        "TELEGRAF_TOKEN_DIR", "/etc/telegraf/tokens"
+    )
+    token_store_path: str = os.environ.get(
+        "TOKEN_STORE_PATH",
+        os.path.join(
+            os.environ.get("TELEGRAF_DIR", "/config/telegraf"), "token_store.json"
+        ),
+    )
+    prometheus_rules_dir: str = os.environ.get(
+        "PROMETHEUS_RULES_DIR", "/config/prometheus/rules"
     )
+    cache_dir: str = os.environ.get("CACHE_DIR", "/config/cache")
 
     # Application settings
     refresh_interval: int = int(os.environ.get("REFRESH_INTERVAL", "3600"))  # 1 hour
+    generations_keep: int = int(os.environ.get("GENERATIONS_KEEP", "5"))
+    max_concurrent_devices: int = int(os.environ.get("MAX_CONCURRENT_DEVICES", "10"))
+    config_watch: bool = os.environ.get("CONFIG_WATCH", "true").lower() == "true"
+    config_watch_debounce: float = float(
+        os.environ.get("CONFIG_WATCH_DEBOUNCE", "2")
+    )  # seconds
+    config_poll_interval: float = float(
+        os.environ.get("CONFIG_POLL_INTERVAL", "5")
+    )  # seconds, without inotify
+    # One Grafana dashboard per device, or per device type
+    dashboard_mode: str = os.environ.get("DASHBOARD_MODE", "device").lower()
     debug: bool = os.environ.get("DEBUG", "false").lower() == "true"
+    # Prometheus lifecycle endpoint, to load new recording rules
+    prometheus_reload_url: Optional[str] = (
+        os.environ.get("PROMETHEUS_RELOAD_URL") or None
+    )
+
+    # HTTP client settings
+    http_timeout: float = float(os.environ.get("HTTP_TIMEOUT", "10"))  # seconds
+    max_concurrent_requests_per_device: int = int(
+        os.environ.get("MAX_CONCURRENT_REQUESTS_PER_DEVICE", "4")
+    )
+    http2: bool = os.environ.get("HTTP2", "false").lower() == "true"
+    http_pool_max_hosts: int = int(os.environ.get("HTTP_POOL_MAX_HOSTS", "100"))
+    http_pool_max_connections: int = int(
+        os.environ.get("HTTP_POOL_MAX_CONNECTIONS", "20")
+    )  # per host
+    http_pool_max_keepalive: int = int(os.environ.get("HTTP_POOL_MAX_KEEPALIVE", "10"))
+    http_pool_idle_timeout: float = float(
+        os.environ.get("HTTP_POOL_IDLE_TIMEOUT", "60")
+    )  # seconds
+
+    # Authentication tokens
+    token_ttl: int = int(
+        os.environ.get("TOKEN_TTL", "3600")
+    )  # seconds, for tokens without expires_in
+    token_refresh_margin: int = int(os.environ.get("TOKEN_REFRESH_MARGIN", "60"))
+    token_refresh_check_interval: int = int(
+        os.environ.get("TOKEN_REFRESH_CHECK_INTERVAL", "30")
+    )
+    token_store_write_delay: float = float(
+        os.environ.get("TOKEN_STORE_WRITE_DELAY", "1")
+    )  # seconds
+
+    # Limits for sampled responses and OpenAPI documents
+    json_max_bytes: int = int(os.environ.get("JSON_MAX_BYTES", str(8 * 1024 * 1024)))
+    json_max_depth: int = int(os.environ.get("JSON_MAX_DEPTH", "64"))
+    json_max_nodes: int = int(os.environ.get("JSON_MAX_NODES", "100000"))
+    spec_max_bytes: int = int(os.environ.get("SPEC_MAX_BYTES", str(64 * 1024 * 1024)))
+    spec_max_nodes: int = int(os.environ.get("SPEC_MAX_NODES", "2000000"))
+    array_sample_size: int = int(os.environ.get("ARRAY_SAMPLE_SIZE", "16"))
+    analysis_cache_size: int = int(os.environ.get("ANALYSIS_CACHE_SIZE", "1024"))
+
+    # OpenAPI validation: eager, lazy, sampled or disabled
+    openapi_validation: str = os.environ.get("OPENAPI_VALIDATION", "eager").lower()
+    openapi_validation_sample_rate: float = float(
+        os.environ.get("OPENAPI_VALIDATION_SAMPLE_RATE", "0.1")
+    )
+    openapi_validation_workers: int = int(
+        os.environ.get("OPENAPI_VALIDATION_WORKERS", "2")
+    )
 
 
 # Initialize settings
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+from typing import AsyncIterator
+
+from app.core.config import settings
+from app.core.device_config import ConfigSnapshot, load_snapshot
+from app.services.device_service import DeviceService
+
+try:
+    from watchfiles import awatch
+except ImportError:  # pragma: no cover - optional, falls back to polling
+    awatch = None
+
+logger = logging.getLogger("api-monitor.config-watcher")
+
+
+async def watch_config() -> None:
+    """
+    Reprocess devices whenever the device configuration changes
+
+    Only devices that were added or modified are processed again. Removed
+    devices are left out of the new generation and all others keep their
+    live outputs. Bursts of edits are merged into a single run.
+    """
+    current = await asyncio.to_thread(load_snapshot)
+    async for _ in _config_changes(settings.config_path, settings.devices_dir):
+        try:
+            snapshot = await _settled_snapshot()
+            if snapshot.digest is None or snapshot.digest == current.digest:
+                continue
+
+            changed, removed = snapshot.diff(current)
+            current = snapshot
+            if not changed and not removed:
+                continue
+
+            logger.info(
+                f"Configuration changed: {len(changed)} added or modified, {len(removed)} removed"
+            )
+            await DeviceService.process_devices(snapshot, only=changed)
+        except Exception as e:
+            logger.error(f"Error processing configuration change: {str(e)}")
+
+
+async def _settled_snapshot() -> ConfigSnapshot:
+    """Wait until the configuration stops changing, then get its snapshot"""
+    snapshot = await asyncio.to_thread(load_snapshot)
+    while True:
+        await asyncio.sleep(settings.config_watch_debounce)
+        latest = await asyncio.to_thread(load_snapshot)
+        if latest.stat == snapshot.stat:
+            return latest
+        snapshot = latest
+
+
+async def _config_changes(path: str, devices_dir: str) -> AsyncIterator[None]:
+    """Yield whenever the config file or a fragment may have changed"""
+    if awatch is not None:
+        path = os.path.abspath(path)
+        devices_dir = os.path.abspath(devices_dir)
+        # Watch the directories, editors and mounted ConfigMaps replace files
+        directories = [path if os.path.isdir(path) else os.path.dirname(path)]
+        if os.path.isdir(devices_dir) and not devices_dir.startswith(
+            directories[0] + os.sep
+        ):
+            directories.append(devices_dir)
+        try:
+            async for changes in awatch(*directories):
+                if any(
+                    _is_config_file(os.path.abspath(changed_path), path, devices_dir)
+                    for _, changed_path in changes
+                ):
+                    yield
+            return
+        except Exception as e:
+            logger.warning(
+                f"File system events unavailable for {', '.join(directories)}, polling instead: {str(e)}"
+            )
+
+    while True:
+        await asyncio.sleep(settings.config_poll_interval)
+        yield
+
+
+def _is_config_file(changed_path: str, path: str, devices_dir: str) -> bool:
+    """Check whether a changed path belongs to the device configuration"""
+    if os.path.basename(changed_path).startswith(".."):
+        # Kubernetes swaps mounted ConfigMaps through ..data symlinks
+        return True
+    return (
+        changed_path == path
+        or changed_path.startswith(path + os.sep)
+        or changed_path.startswith(devices_dir + os.sep)
+    )
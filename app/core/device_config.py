@@ -1,55 +1,275 @@
+import hashlib
 import logging
-from typing import Any, Dict, List, Optional, Set
+import os
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import yaml
+from pydantic import ValidationError
 
 from app.core.config import settings
+from app.core.device_model import Device
+from app.core.errors import ConfigurationError
 
 logger = logging.getLogger("api-monitor.device-config")
 
+# Use the libyaml parser when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
-class AttributeDict(dict):
-    """Dictionary subclass that allows attribute access to dictionary keys."""
 
-    def __getattr__(self, key):
-        try:
-            return self[key]
-        except KeyError:
-            raise AttributeError(f"'dict object' has no attribute '{key}'")
+class ConfigSnapshot:
+    """
+    Parsed device configuration, shared by every consumer until the file changes
 
-    def __setattr__(self, key, value):
-        self[key] = value
+    The parsed data must be treated as read-only. Devices are validated
+    into immutable models on first use and shared by every consumer of the
+    snapshot.
+    """
 
+    __slots__ = ("path", "stat", "digest", "config", "_devices", "_invalid")
 
-def load_config() -> Dict[str, Any]:
-    """Load configuration from the config file"""
-    try:
-        with open(settings.config_path, "r") as f:
-            config = yaml.safe_load(f)
-        return config
-    except Exception as e:
-        logger.error(f"Error loading configuration: {str(e)}")
-        return {"devices": [], "global": {}}
+    def __init__(
+        self,
+        path: str,
+        stat: Optional[Tuple[Tuple[str, int, int], ...]],
+        digest: Optional[str],
+        config: Dict[str, Any],
+    ):
+        self.path = path
+        self.stat = stat
+        self.digest = digest
+        self.config = config
+        self._devices: Optional[List[Device]] = None
+        self._invalid: Dict[str, str] = {}
 
+    def devices(self) -> List[Device]:
+        """Get the valid devices, including the global config"""
+        if self._devices is None:
+            self._validate()
+        return self._devices
 
-def get_devices() -> List[AttributeDict]:
-    """Get the list of devices from the configuration"""
-    config = load_config()
+    def invalid_devices(self) -> Dict[str, str]:
+        """Get the validation errors of devices that could not be loaded, by name"""
+        if self._devices is None:
+            self._validate()
+        return self._invalid
+
+    def _validate(self) -> None:
+        devices = self.config.get("devices", []) or []
+        global_config = self.config.get("global", {}) or {}
+
+        valid, invalid = [], {}
+        for device in devices:
+            try:
+                valid.append(Device.model_validate({**device, "global": global_config}))
+            except (ValidationError, TypeError) as e:
+                name = (
+                    device.get("name", "unknown")
+                    if isinstance(device, dict)
+                    else "unknown"
+                )
+                invalid[name] = str(e)
+                logger.error(f"Invalid configuration for device {name}: {str(e)}")
+        self._invalid = invalid
+        self._devices = valid
+
+    def device_names(self) -> Set[str]:
+        """Get the set of configured device names"""
+        devices = self.config.get("devices", []) or []
+        return set(device["name"] for device in devices if "name" in device)
+
+    def diff(self, previous: "ConfigSnapshot") -> Tuple[Set[str], Set[str]]:
+        """Get the names of devices added or modified, and removed, since a snapshot"""
+        old = _devices_by_name(previous.config)
+        new = _devices_by_name(self.config)
+        removed = set(old) - set(new)
+        if (previous.config.get("global") or {}) != (self.config.get("global") or {}):
+            # Every device depends on the global settings
+            return set(new), removed
+        changed = {name for name, device in new.items() if old.get(name) != device}
+        return changed, removed
+
+
+def _devices_by_name(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     devices = config.get("devices", []) or []
+    return {device["name"]: device for device in devices if "name" in device}
+
+
+class _ConfigFile:
+    """A parsed config file or fragment"""
+
+    __slots__ = ("stat", "digest", "data")
+
+    def __init__(self, stat: Tuple[int, int], digest: str, data: Any):
+        self.stat = stat
+        self.digest = digest
+        self.data = data
+
+
+# Latest snapshot per config path, and parsed files by path
+_snapshots: Dict[str, ConfigSnapshot] = {}
+_files: Dict[str, _ConfigFile] = {}
+_snapshots_lock = threading.Lock()
+
+
+def load_snapshot(path: Optional[str] = None) -> ConfigSnapshot:
+    """
+    Get the snapshot of the device configuration, parsing only what changed
+
+    The configuration is the config file together with the YAML fragments
+    in the devices directory (or in CONFIG_PATH itself if it is a
+    directory). A snapshot is reused while the mtime and size of all files
+    are unchanged. Otherwise only changed files are read and hashed, and
+    only files whose content differs are parsed again.
 
-    # Convert each device to AttributeDict and include global config
-    global_config = AttributeDict(config.get("global", {}))
+    If any file cannot be loaded, or a device is defined more than once,
+    the last valid snapshot is kept. Without one, the snapshot is empty
+    and has no digest.
+    """
+    path = path or settings.config_path
+    with _snapshots_lock:
+        cached = _snapshots.get(path)
+        try:
+            stats = []
+            for file_path in _config_files(path):
+                stat_result = os.stat(file_path)
+                stats.append((file_path, stat_result.st_mtime_ns, stat_result.st_size))
+            stat = tuple(stats)
+            if cached is not None and cached.stat == stat:
+                return cached
+
+            # Parse each file on its own, so a bad fragment names itself
+            files, failed = [], []
+            for file_path, mtime, size in stat:
+                try:
+                    files.append(_load_file(file_path, (mtime, size)))
+                except Exception as e:
+                    logger.error(
+                        f"Error loading configuration file {file_path}: {str(e)}"
+                    )
+                    failed.append(file_path)
+            if failed:
+                raise ConfigurationError(
+                    f"Invalid configuration file(s): {', '.join(failed)}"
+                )
+
+            digest = hashlib.sha256(
+                "\x00".join(
+                    f"{file_path}:{config_file.digest}"
+                    for (file_path, _, _), config_file in zip(stat, files)
+                ).encode("utf-8")
+            ).hexdigest()
+            if cached is not None and cached.digest == digest:
+                # Touched but unchanged, keep the validated devices too
+                snapshot = ConfigSnapshot(path, stat, digest, cached.config)
+                snapshot._devices = cached._devices
+                snapshot._invalid = cached._invalid
+            else:
+                config = _merge(
+                    [
+                        (file_path, config_file.data)
+                        for (file_path, _, _), config_file in zip(stat, files)
+                    ]
+                )
+                snapshot = ConfigSnapshot(path, stat, digest, config)
+                logger.info(f"Loaded configuration from {len(files)} file(s) at {path}")
+        except Exception as e:
+            logger.error(f"Error loading configuration: {str(e)}")
+            if cached is not None:
+                # Removing every device over a broken edit would be worse
+                logger.warning(f"Keeping the last valid configuration from {path}")
+                return cached
+            return ConfigSnapshot(path, None, None, {"devices": [], "global": {}})
+
+        _snapshots[path] = snapshot
+        # Forget files that are no longer part of any configuration
+        in_use = {
+            file_path
+            for cached_snapshot in _snapshots.values()
+            for file_path, _, _ in cached_snapshot.stat or ()
+        }
+        for file_path in set(_files) - in_use:
+            del _files[file_path]
+        return snapshot
+
+
+def _config_files(path: str) -> List[str]:
+    """List the config file and fragments making up a configuration"""
+    if os.path.isdir(path):
+        files, devices_dir = [], path
+    else:
+        files, devices_dir = [path], settings.devices_dir
+
+    if os.path.isdir(devices_dir):
+        files.extend(
+            os.path.join(devices_dir, name)
+            for name in sorted(os.listdir(devices_dir))
+            if name.endswith((".yml", ".yaml")) and not name.startswith(".")
+        )
+    if not files:
+        raise FileNotFoundError(f"No device configuration found at {path}")
+    return files
+
+
+def _load_file(path: str, stat: Tuple[int, int]) -> _ConfigFile:
+    """Parse a config file, reusing the previous result if it is unchanged"""
+    cached = _files.get(path)
+    if cached is not None and cached.stat == stat:
+        return cached
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    if cached is not None and cached.digest == digest:
+        config_file = _ConfigFile(stat, digest, cached.data)
+    else:
+        config_file = _ConfigFile(stat, digest, yaml.load(data, Loader=YamlLoader))
+    _files[path] = config_file
+    return config_file
 
-    result = []
-    for device in devices:
-        device_config = AttributeDict(device.copy())
-        device_config["global"] = global_config
-        result.append(device_config)
 
-    return result
+def _merge(fragments: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    """
+    Merge parsed files into one configuration
+
+    Each file holds a devices list and optionally global settings, or just
+    a list of devices. Global settings of later files override earlier ones.
+    A device name may only be defined once across all files.
+    """
+    global_config: Dict[str, Any] = {}
+    devices: List[Dict[str, Any]] = []
+    sources: Dict[str, str] = {}
+    for file_path, data in fragments:
+        if isinstance(data, list):
+            file_devices = data
+        elif isinstance(data, dict):
+            global_config.update(data.get("global", {}) or {})
+            file_devices = data.get("devices", []) or []
+        else:
+            continue
+
+        for device in file_devices:
+            name = device.get("name") if isinstance(device, dict) else None
+            if name is not None:
+                if name in sources:
+                    raise ConfigurationError(
+                        f"Device {name} is defined in both {sources[name]} and {file_path}"
+                    )
+                sources[name] = file_path
+            devices.append(device)
+    return {"devices": devices, "global": global_config}
+
+
+def load_config() -> Dict[str, Any]:
+    """Load configuration from the config file"""
+    return load_snapshot().config
+
+
+def get_devices() -> List[Device]:
+    """Get the list of devices from the configuration"""
+    return load_snapshot().devices()
 
 
 def get_device_names() -> Set[str]:
     """Get the set of current device names for cleanup"""
-    devices = get_devices()
-    return set(device["name"] for device in devices if "name" in device)
+    return load_snapshot().device_names()
@@ -0,0 +1,80 @@
+import os
+from typing import Any, Dict, List, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+
+
+def resolve_secret(value: Optional[str]) -> Optional[str]:
+    """Resolve a ${VAR} reference to the value of the environment variable"""
+    if value and value.startswith("${") and value.endswith("}"):
+        return os.environ.get(value[2:-1], "")
+    return value
+
+
+class ApiConfig(BaseModel):
+    """
+    How to reach and authenticate against a device's API
+
+    Secrets keep their configured form, which may be a ${VAR} reference
+    that Telegraf resolves itself. The resolved values are looked up once,
+    when the configuration is loaded.
+    """
+
+    model_config = ConfigDict(frozen=True, extra="allow")
+
+    base_url: str
+    auth_type: str = "none"
+    # False, or the path of a CA bundle to verify against
+    verify_ssl: Union[bool, str] = True
+    username: Optional[str] = None
+    password: Optional[str] = None
+    token: Optional[str] = None
+
+    # Logins for token_from_auth devices
+    auth_endpoint: Optional[str] = None
+    auth_method: str = "POST"
+    auth_payload: Dict[str, Any] = Field(default_factory=dict)
+    token_path: str = "token"
+    auth_type_extension: Optional[str] = None
+    openid_client_id: str = "webui"  # Default for Prismon
+    openid_scope: str = "offline_access"
+
+    # Discovery
+    swagger_url: Optional[str] = None
+    endpoints: Optional[List[Dict[str, Any]]] = None
+    max_concurrent_requests: Optional[int] = None
+    metrics_type: Optional[str] = None
+    metrics_path: Optional[str] = None
+
+    _password: Optional[str] = PrivateAttr(default=None)
+    _token: Optional[str] = PrivateAttr(default=None)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._password = resolve_secret(self.password)
+        self._token = resolve_secret(self.token)
+
+    @property
+    def resolved_password(self) -> Optional[str]:
+        """The password, with environment references resolved"""
+        return self._password
+
+    @property
+    def resolved_token(self) -> Optional[str]:
+        """The bearer token, with environment references resolved"""
+        return self._token
+
+
+class Device(BaseModel):
+    """A monitored device, validated once per configuration revision"""
+
+    model_config = ConfigDict(frozen=True, extra="allow", populate_by_name=True)
+
+    name: str
+    type: str = "generic"
+    description: Optional[str] = None
+    api: ApiConfig
+    global_config: Dict[str, Any] = Field(default_factory=dict, alias="global")
+
+    # Set on the copy used for one run when authentication failed
+    auth_failed: bool = False
+    auth_error: Optional[str] = None
@@ -61,6 +61,17 @@ class DiscoveryError(ApiMonitorException):
         )
 
 
+class GenerationNotFoundError(ApiMonitorException):
+    """Exception for unknown output generations"""
+
+    def __init__(self, generation: str):
+        super().__init__(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Generation not found: {generation}",
+            error_code="generation_not_found",
+        )
+
+
 def setup_exception_handlers(app: FastAPI) -> None:
     """Configure exception handlers for the application"""
 
@@ -0,0 +1,298 @@
+import asyncio
+import filecmp
+import logging
+import os
+import shutil
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from app.core.build_manifest import BuildManifest
+from app.core.config import settings
+from app.core.errors import GenerationNotFoundError
+
+logger = logging.getLogger("api-monitor.generations")
+
+GENERATIONS_DIR = "generations"
+CURRENT_LINK = "current"
+STAGING_SUFFIX = ".staging"
+
+# Output kinds, each with its own generation store
+TELEGRAF = "telegraf"
+GRAFANA = "grafana"
+PROMETHEUS = "prometheus"
+
+# Directories every generation holds, even without any device, since
+# Telegraf and Prometheus are pointed at them
+OUTPUT_DIRS = {TELEGRAF: ("telegraf.d",), PROMETHEUS: ("devices", "types")}
+
+
+class GenerationStore:
+    """
+    Versioned output directory with an atomically switched live generation
+
+    Every generation is written to {root}/generations/<id>.staging, renamed
+    to {root}/generations/<id> once complete and then made live by pointing
+    the relative {root}/current symlink at it. The symlink is replaced with
+    a single rename, so readers always see one complete generation.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.generations_dir = os.path.join(root, GENERATIONS_DIR)
+        self.current_link = os.path.join(root, CURRENT_LINK)
+
+    def path(self, generation: str) -> str:
+        """Get the directory of a generation"""
+        return os.path.join(self.generations_dir, generation)
+
+    def staging_path(self, generation: str) -> str:
+        """Get the directory a generation is written to before publishing"""
+        return self.path(generation) + STAGING_SUFFIX
+
+    def current(self) -> Optional[str]:
+        """Get the id of the live generation"""
+        try:
+            target = os.readlink(self.current_link)
+        except OSError:
+            return None
+        generation = os.path.basename(os.path.normpath(target))
+        return generation if os.path.isdir(self.path(generation)) else None
+
+    def list(self) -> List[str]:
+        """List the published generations, oldest first"""
+        if not os.path.isdir(self.generations_dir):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.generations_dir)
+            if not name.endswith(STAGING_SUFFIX)
+        )
+
+    def stage(self, generation: str, subdirs: Iterable[str] = ()) -> str:
+        """Create an empty staging directory for a generation"""
+        path = self.staging_path(generation)
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        for subdir in subdirs:
+            os.makedirs(os.path.join(path, subdir))
+        return path
+
+    def publish(self, generation: str) -> None:
+        """Complete a staged generation and make it live"""
+        os.replace(self.staging_path(generation), self.path(generation))
+        self.activate(generation)
+
+    def activate(self, generation: str) -> None:
+        """Atomically point the current symlink at a generation"""
+        # Only generation ids, never paths leading out of the store
+        if generation != os.path.basename(generation) or generation in ("", ".", ".."):
+            raise GenerationNotFoundError(generation)
+        if not os.path.isdir(self.path(generation)):
+            raise GenerationNotFoundError(generation)
+        tmp_link = f"{self.current_link}.tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.join(GENERATIONS_DIR, generation), tmp_link)
+        os.replace(tmp_link, self.current_link)
+
+    def discard(self, generation: str) -> None:
+        """Remove a staged generation that will not be published"""
+        shutil.rmtree(self.staging_path(generation), ignore_errors=True)
+
+    def prune(self, keep: int) -> None:
+        """Remove all but the newest generations, never the live one"""
+        current = self.current()
+        generations = self.list()
+        for generation in generations[: max(0, len(generations) - max(1, keep))]:
+            if generation != current:
+                shutil.rmtree(self.path(generation), ignore_errors=True)
+
+        # Staging directories left behind by interrupted runs
+        if os.path.isdir(self.generations_dir):
+            for name in os.listdir(self.generations_dir):
+                if name.endswith(STAGING_SUFFIX):
+                    shutil.rmtree(
+                        os.path.join(self.generations_dir, name), ignore_errors=True
+                    )
+
+
+# Initialize the shared generation stores
+generation_stores = {
+    TELEGRAF: GenerationStore(settings.telegraf_dir),
+    GRAFANA: GenerationStore(settings.grafana_dir),
+    PROMETHEUS: GenerationStore(settings.prometheus_rules_dir),
+}
+
+
+class GenerationRun:
+    """
+    Outputs of one processing run, staged until they are published
+
+    Devices whose inputs did not change, or whose processing failed, carry
+    their outputs forward from the live generation by hard-linking them, so
+    every generation is complete on its own. File operations run in worker
+    threads to keep the event loop free.
+    """
+
+    def __init__(self):
+        self.id = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        self.dirs: Dict[str, str] = {}
+        self.previous_dirs: Dict[str, Optional[str]] = {}
+        self.previous = BuildManifest()
+        self.manifest = BuildManifest()
+
+    async def start(self) -> None:
+        """Load the live generation and create the staging directories"""
+        await asyncio.to_thread(self._load_previous)
+        for kind, store in generation_stores.items():
+            self.dirs[kind] = await asyncio.to_thread(
+                store.stage, self.id, OUTPUT_DIRS.get(kind, ())
+            )
+
+    def _load_previous(self) -> None:
+        """Find the live generation and load its manifest"""
+        for kind, store in generation_stores.items():
+            generation = store.current()
+            self.previous_dirs[kind] = store.path(generation) if generation else None
+        self.previous = BuildManifest.load(self.previous_dirs[TELEGRAF])
+
+    def output_path(self, kind: str, relative_path: str) -> str:
+        """Get the staged path of an output file"""
+        return os.path.join(self.dirs[kind], relative_path)
+
+    async def write(self, kind: str, relative_path: str, content: str) -> None:
+        """Write an output file into the staged generation"""
+        await asyncio.to_thread(
+            _write_file, self.output_path(kind, relative_path), content
+        )
+
+    async def carry_forward(
+        self, device_name: str, kinds: Optional[Iterable[str]] = None
+    ) -> bool:
+        """Reuse a device's outputs from the live generation"""
+        outputs = self.previous.outputs(device_name)
+        if kinds is not None:
+            outputs = {kind: path for kind, path in outputs.items() if kind in kinds}
+        if not outputs:
+            return False
+        if not await asyncio.to_thread(self._link_outputs, outputs):
+            return False
+        if kinds is None:
+            self.manifest.entries[device_name] = self.previous.entries[device_name]
+        return True
+
+    def _link_outputs(self, outputs: Dict[str, str]) -> bool:
+        """Hard-link outputs from the live generation, copying if linking fails"""
+        for kind, relative_path in outputs.items():
+            previous_dir = self.previous_dirs.get(kind)
+            if previous_dir is None:
+                return False
+            source = os.path.join(previous_dir, relative_path)
+            if not os.path.exists(source):
+                return False
+            target = self.output_path(kind, relative_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copy2(source, target)
+        return True
+
+    async def publish(self) -> bool:
+        """
+        Make the staged generation live and prune old generations
+
+        A generation identical to the live one is discarded instead, so
+        runs that change nothing neither use up the rollback history nor
+        make Grafana and Prometheus reload. Returns whether it was published.
+        """
+        if await asyncio.to_thread(self._unchanged):
+            await self.discard()
+            logger.info("No changes, keeping the live generation")
+            return False
+        await asyncio.to_thread(self._publish)
+        logger.info(f"Published generation {self.id}")
+        return True
+
+    def _unchanged(self) -> bool:
+        """Check whether the staged outputs match the live generation"""
+        if self.manifest.entries != self.previous.entries:
+            return False
+        for kind, staged_dir in self.dirs.items():
+            previous_dir = self.previous_dirs.get(kind)
+            if previous_dir is None or not _same_files(staged_dir, previous_dir):
+                return False
+        return True
+
+    def _publish(self) -> None:
+        self.manifest.save(self.dirs[TELEGRAF])
+        for store in generation_stores.values():
+            store.publish(self.id)
+        for store in generation_stores.values():
+            store.prune(settings.generations_keep)
+
+    async def discard(self) -> None:
+        """Drop the staged generation"""
+        for store in generation_stores.values():
+            await asyncio.to_thread(store.discard, self.id)
+
+
+def list_generations() -> Dict[str, Any]:
+    """List the kept generations and the live one"""
+    store = generation_stores[TELEGRAF]
+    return {"current": store.current(), "generations": store.list()}
+
+
+def rollback(generation: Optional[str] = None) -> str:
+    """Make a kept generation live again, by default the one before the live one"""
+    store = generation_stores[TELEGRAF]
+    if generation is None:
+        generations = store.list()
+        current = store.current()
+        older = [g for g in generations if current is None or g < current]
+        if not older:
+            raise GenerationNotFoundError("previous")
+        generation = older[-1]
+
+    # Only published generations, so the id cannot point anywhere else
+    for kind_store in generation_stores.values():
+        if generation not in kind_store.list():
+            raise GenerationNotFoundError(generation)
+    for kind_store in generation_stores.values():
+        kind_store.activate(generation)
+
+    logger.info(f"Rolled back to generation {generation}")
+    return generation
+
+
+def _same_files(staged_dir: str, previous_dir: str) -> bool:
+    """Compare the output files of two generation directories"""
+    staged = _relative_files(staged_dir)
+    if staged != _relative_files(previous_dir):
+        return False
+    for relative_path in staged:
+        staged_path = os.path.join(staged_dir, relative_path)
+        previous_path = os.path.join(previous_dir, relative_path)
+        # Carried forward outputs are hard links to the live files
+        if not os.path.samefile(staged_path, previous_path) and not filecmp.cmp(
+            staged_path, previous_path, shallow=False
+        ):
+            return False
+    return True
+
+
+def _relative_files(directory: str) -> Set[str]:
+    """List the files of a generation, without its manifest"""
+    files = set()
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.relpath(os.path.join(root, name), directory)
+            if path != BuildManifest.FILENAME:
+                files.add(path)
+    return files
+
+
+def _write_file(path: str, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import ssl
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, AsyncIterator, Dict, List, Tuple, Union
+from urllib.parse import urlsplit
+
+import httpx
+
+from app.core.config import settings
+
+logger = logging.getLogger("api-monitor.http-pool")
+
+# (scheme, host, port, verify_ssl)
+PoolKey = Tuple[str, str, int, Any]
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _http2_available() -> bool:
+    """Check whether the optional h2 package needed for HTTP/2 is installed"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _ssl_verify(verify_ssl: Union[bool, str]) -> Union[bool, ssl.SSLContext]:
+    """Get httpx's verify option, loading a CA bundle path into an SSL context"""
+    if isinstance(verify_ssl, str):
+        # httpx deprecated passing the path itself
+        return ssl.create_default_context(cafile=verify_ssl)
+    return verify_ssl
+
+
+class _PooledClient:
+    """A pooled client together with its usage bookkeeping"""
+
+    __slots__ = ("client", "in_use", "last_used", "slots")
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        # One slot per connection the client may open
+        self.slots = asyncio.Semaphore(max(1, settings.http_pool_max_connections))
+
+
+class HttpClientPool:
+    """
+    Process-wide pool of keep-alive HTTP clients
+
+    One client is kept per (scheme, host, port, verify_ssl), so every device,
+    token request and export that targets the same gateway or identity
+    provider reuses its TCP/TLS connections. Credentials are never stored on
+    the pooled clients; callers pass them per request. Borrowers of a client
+    wait for one of its connections to be free, so devices behind the same
+    host queue up instead of timing out on the connection pool.
+    """
+
+    def __init__(self):
+        self._clients: "OrderedDict[PoolKey, _PooledClient]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.http2 = settings.http2 and _http2_available()
+        if settings.http2 and not self.http2:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed")
+
+    @staticmethod
+    def key_for(url: str, verify_ssl: Any = True) -> PoolKey:
+        """Build the pool key for a URL"""
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or DEFAULT_PORTS.get(scheme, 0)
+        return (scheme, (parts.hostname or "").lower(), port, verify_ssl)
+
+    @asynccontextmanager
+    async def client(
+        self, url: str, verify_ssl: Any = True
+    ) -> AsyncIterator[httpx.AsyncClient]:
+        """Borrow the pooled client for the host of a URL"""
+        entry = self._acquire(self.key_for(url, verify_ssl))
+        try:
+            async with entry.slots:
+                yield entry.client
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            await self._evict()
+
+    async def request(
+        self, method: str, url: str, verify_ssl: Any = True, **kwargs: Any
+    ) -> httpx.Response:
+        """Send a single request through the pooled client for its host"""
+        async with self.client(url, verify_ssl) as client:
+            return await client.request(method, url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return pool hit/miss counters"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "clients": len(self._clients),
+            "in_use": sum(entry.in_use for entry in self._clients.values()),
+            "http2": self.http2,
+        }
+
+    async def close(self) -> None:
+        """Close every pooled client"""
+        entries = list(self._clients.values())
+        self._clients.clear()
+        for entry in entries:
+            await entry.client.aclose()
+
+    def _acquire(self, key: PoolKey) -> _PooledClient:
+        """Get or create the client for a pool key"""
+        entry = self._clients.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._clients.move_to_end(key)
+        else:
+            self.misses += 1
+            entry = _PooledClient(self._create_client(key))
+            self._clients[key] = entry
+        entry.in_use += 1
+        return entry
+
+    def _create_client(self, key: PoolKey) -> httpx.AsyncClient:
+        """Create a keep-alive client for a pool key"""
+        scheme, host, port, verify_ssl = key
+        logger.debug(f"Opening pooled HTTP client for {scheme}://{host}:{port}")
+        client = httpx.AsyncClient(
+            verify=_ssl_verify(verify_ssl),
+            http2=self.http2,
+            timeout=httpx.Timeout(settings.http_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.http_pool_max_connections,
+                max_keepalive_connections=settings.http_pool_max_keepalive,
+                keepalive_expiry=settings.http_pool_idle_timeout,
+            ),
+        )
+        # Devices sharing a host must not share session cookies, each
+        # discovery keeps its own jar and sends it per request. httpx copies
+        # a jar passed to the client, so the policy is set on its own jar.
+        client.cookies.jar.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return client
+
+    async def _evict(self) -> None:
+        """Close clients that are idle for too long or exceed the pool size"""
+        now = time.monotonic()
+        evicted: List[_PooledClient] = []
+
+        for key, entry in list(self._clients.items()):
+            if (
+                entry.in_use == 0
+                and now - entry.last_used > settings.http_pool_idle_timeout
+            ):
+                evicted.append(self._clients.pop(key))
+
+        # Least recently used clients are at the front of the ordered dict
+        for key, entry in list(self._clients.items()):
+            if len(self._clients) <= settings.http_pool_max_hosts:
+                break
+            if entry.in_use == 0:
+                evicted.append(self._clients.pop(key))
+
+        self.evictions += len(evicted)
+        for entry in evicted:
+            await entry.client.aclose()
+
+
+# Initialize the shared pool
+http_pool = HttpClientPool()
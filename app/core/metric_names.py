@@ -0,0 +1,96 @@
+import json
+import re
+from typing import Dict, Optional, Tuple
+
+# Measurement names of the generated Telegraf inputs, as exported to Prometheus
+API_MEASUREMENT = "device_api"
+HEALTH_MEASUREMENT = "device_health"
+
+# Series recorded by the generated Prometheus rules
+HEALTH_UP_RECORD = "device:health_up:max"
+HEALTH_AVAILABILITY_RECORD = "device:health_availability:avg_1h"
+RESPONSE_TIME_RECORD = "device:health_response_time_seconds:p{quantile}_5m"
+
+# Response time quantiles recorded for every device, in percent
+RESPONSE_TIME_QUANTILES = (50, 90, 99)
+
+# Aggregation recorded across the elements of array metrics
+ROLLUP_AGGREGATION = "avg"
+
+# Aggregations recorded across the devices of a type
+TYPE_ROLLUP_AGGREGATIONS = ("avg", "sum")
+
+
+def series_name(metric_path: str) -> Tuple[str, bool]:
+    """
+    Get the Prometheus name of a discovered metric, and whether it is a regex
+
+    Telegraf's JSON parser joins nested keys with underscores and numbers
+    the elements of nested arrays, and the Prometheus output prefixes the
+    result with the measurement name. Elements of a top-level array become
+    separate series with unprefixed fields.
+    """
+    parts = []
+    is_regex = False
+    for part in re.sub(r"^(\[\*\]\.?)+", "", metric_path).split("."):
+        if not part:
+            continue
+        arrays = part.count("[*]")
+        name = re.sub(r"[^a-zA-Z0-9_]", "_", part.replace("[*]", ""))
+        parts.append(name + "_[0-9]+" * arrays)
+        is_regex = is_regex or arrays > 0
+    return "_".join([API_MEASUREMENT] + parts), is_regex
+
+
+def tag_key(tag_path: str) -> Optional[str]:
+    """
+    Get the key Telegraf's JSON parser gives a discovered tag
+
+    Elements of a top-level array become separate metrics keyed by their
+    own fields, so their identifiers stay usable as tags. Fields of nested
+    arrays are numbered per element and get None.
+    """
+    path = re.sub(r"^(\[\*\]\.?)+", "", tag_path)
+    if not path or "[*]" in path:
+        return None
+    return path.replace(".", "_")
+
+
+def rollup_record(metric_path: str, aggregation: str) -> str:
+    """Get the recorded series aggregating the elements of an array metric"""
+    name, _ = series_name(metric_path)
+    return f"{API_MEASUREMENT}:{name[len(API_MEASUREMENT) + 1:].replace('_[0-9]+', '')}:{aggregation}"
+
+
+def type_rollup_record(metric_path: str, aggregation: str) -> str:
+    """Get the recorded series aggregating a metric across the devices of a type"""
+    return (
+        "device_type" + rollup_record(metric_path, aggregation)[len(API_MEASUREMENT) :]
+    )
+
+
+def metric_group(metric_path: str) -> str:
+    """Get the section a metric is shown in, from the first part of its path"""
+    parts = metric_path.split(".")
+    return parts[0].title() if len(parts) > 1 else "General"
+
+
+def label_value(value: str) -> str:
+    """Quote a PromQL label value"""
+    return json.dumps(value)
+
+
+def selector(name: str, matchers: Dict[str, str], is_regex: bool = False) -> str:
+    """Build a PromQL selector with exact label matchers"""
+    labels = [f"{label}={label_value(value)}" for label, value in matchers.items()]
+    if is_regex:
+        return "{" + ", ".join([f'__name__=~"{name}"'] + labels) + "}"
+    return name + "{" + ", ".join(labels) + "}"
+
+
+def metric_selector(metric_path: str, device_name: str, endpoint_path: str) -> str:
+    """Select the series of a discovered metric on one device and endpoint"""
+    name, is_regex = series_name(metric_path)
+    return selector(
+        name, {"device_name": device_name, "endpoint": endpoint_path}, is_regex
+    )
@@ -0,0 +1,34 @@
+from typing import Any, Dict, List
+
+from app.core.device_model import Device
+
+
+def polled_endpoints(
+    device: Device, api_structure: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """
+    Get the endpoints Telegraf polls for metrics
+
+    Only GET endpoints without path parameters that yielded metrics or
+    tags are polled. Endpoints taken from an OpenAPI specification must
+    also be listed in the device's configured endpoints, so Telegraf
+    does not poll every path the specification documents. The Telegraf
+    inputs, recording rules and dashboards are all built from this list,
+    so no rule or panel reads a series that is never collected.
+    """
+    configured = {
+        (endpoint.get("path") or "/", endpoint.get("method", "GET").upper())
+        for endpoint in device.api.endpoints or []
+    }
+    return [
+        endpoint
+        for endpoint in api_structure.get("endpoints", [])
+        if endpoint.get("status") == "ok"
+        and endpoint.get("method") == "GET"
+        and "{" not in endpoint["path"]
+        and (endpoint.get("metrics") or endpoint.get("tags"))
+        and (
+            endpoint.get("source") != "openapi"
+            or (endpoint["path"] or "/", "GET") in configured
+        )
+    ]
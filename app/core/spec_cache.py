@@ -0,0 +1,99 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger("api-monitor.spec-cache")
+
+
+class SpecCache:
+    """
+    On-disk cache of OpenAPI specifications
+
+    Each entry records the validators (ETag/Last-Modified) and body hash of
+    the last downloaded specification together with the api_structure that
+    was extracted from it, so an unchanged specification never has to be
+    downloaded or processed again.
+    """
+
+    # Bump when the extracted api_structure format changes
+    FORMAT_VERSION = 2
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+    def _path(self, url: str) -> str:
+        """Get the cache file path for a specification URL"""
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """Get the cache entry for a specification URL"""
+        entry = self._entries.get(url)
+        if entry is None:
+            path = self._path(url)
+            if not os.path.exists(path):
+                return None
+            try:
+                with open(path, "r") as f:
+                    entry = json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading cached specification for {url}: {str(e)}")
+                return None
+            if entry.get("version") != self.FORMAT_VERSION or entry.get("url") != url:
+                return None
+            self._entries[url] = entry
+        return entry
+
+    def put(
+        self,
+        url: str,
+        body_hash: str,
+        api_structure: Dict[str, Any],
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> None:
+        """Store the extracted structure of a specification"""
+        entry = {
+            "version": self.FORMAT_VERSION,
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "body_hash": body_hash,
+            "api_structure": copy.deepcopy(api_structure),
+        }
+        self._entries[url] = entry
+        try:
+            path = self._path(url)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error saving cached specification for {url}: {str(e)}")
+
+    @staticmethod
+    def conditional_headers(entry: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """Build If-None-Match/If-Modified-Since headers for a cache entry"""
+        headers = {}
+        if entry:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    @staticmethod
+    def structure(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Get a private copy of the cached api_structure"""
+        return copy.deepcopy(entry["api_structure"])
+
+
+# Initialize the shared cache
+spec_cache = SpecCache(os.path.join(settings.cache_dir, "specs"))
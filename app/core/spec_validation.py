@@ -0,0 +1,134 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from openapi_spec_validator import validate
+
+from app.core.config import settings
+
+logger = logging.getLogger("api-monitor.spec-validation")
+
+VALIDATION_MODES = ("eager", "lazy", "sampled", "disabled")
+
+
+def _validate_document(body: bytes) -> Optional[str]:
+    """Validate a raw specification document, returning the error if invalid"""
+    try:
+        validate(json.loads(body))
+        return None
+    except Exception as e:
+        return str(e)[:1000]
+
+
+class SpecValidator:
+    """
+    Memoized OpenAPI validation in a process pool
+
+    Results are keyed by the content hash of the specification, so a spec
+    shared by many devices is validated once. Cache misses run in worker
+    processes, so they neither block the event loop nor serialize across
+    devices. The OPENAPI_VALIDATION setting selects the mode:
+
+    - eager: wait for the result before extracting the specification
+    - lazy: validate in the background and only log the result
+    - sampled: validate a fraction of new specifications, eagerly
+    - disabled: skip validation
+    """
+
+    def __init__(self):
+        self._results: Dict[str, Optional[str]] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def validate(self, body: bytes, content_hash: str, device_name: str) -> None:
+        """Validate a specification according to the configured mode"""
+        mode = settings.openapi_validation
+        if mode not in VALIDATION_MODES:
+            logger.warning(f"Unknown OPENAPI_VALIDATION mode '{mode}', using eager")
+            mode = "eager"
+
+        if mode == "disabled":
+            return
+
+        if content_hash in self._results:
+            self._log_result(device_name, self._results[content_hash])
+            return
+
+        task = self._pending.get(content_hash)
+        if task is None:
+            if (
+                mode == "sampled"
+                and random.random() >= settings.openapi_validation_sample_rate
+            ):
+                logger.debug(f"Skipping sampled OpenAPI validation for {device_name}")
+                return
+            task = asyncio.create_task(self._run(body, content_hash))
+            self._pending[content_hash] = task
+
+        if mode == "lazy":
+
+            def log_when_done(done: asyncio.Task) -> None:
+                if done.cancelled():
+                    return
+                if done.exception() is not None:
+                    self._log_failure(device_name, done.exception())
+                else:
+                    self._log_result(device_name, done.result())
+
+            task.add_done_callback(log_when_done)
+            return
+
+        try:
+            self._log_result(device_name, await asyncio.shield(task))
+        except Exception as e:
+            self._log_failure(device_name, e)
+
+    async def _run(self, body: bytes, content_hash: str) -> Optional[str]:
+        """Validate in the process pool and memoize the result"""
+        try:
+            loop = asyncio.get_running_loop()
+            error = await loop.run_in_executor(
+                self._get_executor(), _validate_document, body
+            )
+            self._results[content_hash] = error
+            return error
+        finally:
+            self._pending.pop(content_hash, None)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """Create the worker pool on first use"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=max(1, settings.openapi_validation_workers),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    @staticmethod
+    def _log_result(device_name: str, error: Optional[str]) -> None:
+        """Log the validation result for a device"""
+        if error is None:
+            logger.info(f"Valid OpenAPI specification found for {device_name}")
+        else:
+            logger.warning(f"Invalid OpenAPI specification for {device_name}: {error}")
+
+    @staticmethod
+    def _log_failure(device_name: str, error: BaseException) -> None:
+        """Log a validation run that could not complete"""
+        logger.error(
+            f"OpenAPI validation failed to run for {device_name}: {str(error)}"
+        )
+
+    def shutdown(self) -> None:
+        """Stop the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Initialize the shared validator
+spec_validator = SpecValidator()
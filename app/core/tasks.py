@@ -1,21 +1,46 @@
 import asyncio
 import logging
-
-from fastapi import BackgroundTasks
+from typing import List
 
 from app.core.config import settings
+from app.core.config_watcher import watch_config
 from app.services.device_service import DeviceService
+from app.services.token_broker import token_broker
 
 logger = logging.getLogger("api-monitor.tasks")
 
 
-async def start_background_tasks(background_tasks: BackgroundTasks) -> None:
+async def start_background_tasks() -> List[asyncio.Task]:
     """Start all background tasks"""
-    # Initial device processing
-    background_tasks.add_task(DeviceService.process_devices)
-
-    # Start periodic refresh task
-    background_tasks.add_task(periodic_refresh)
+    # Renew device tokens before they expire
+    token_broker.start()
+
+    tasks = [
+        # Initial device processing
+        asyncio.create_task(initial_processing()),
+        # Start periodic refresh task
+        asyncio.create_task(periodic_refresh()),
+    ]
+    if settings.config_watch:
+        # Process configuration changes as they happen
+        tasks.append(asyncio.create_task(watch_config()))
+    return tasks
+
+
+async def stop_background_tasks(tasks: List[asyncio.Task]) -> None:
+    """Cancel the background tasks and wait for them to finish"""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await token_broker.stop()
+
+
+async def initial_processing() -> None:
+    """Process devices once at startup"""
+    try:
+        await DeviceService.process_devices()
+    except Exception as e:
+        logger.error(f"Error processing devices at startup: {str(e)}")
 
 
 async def periodic_refresh() -> None:
@@ -0,0 +1,39 @@
+import logging
+import os
+from typing import Optional
+
+import jinja2
+
+from app.core.config import settings
+
+logger = logging.getLogger("api-monitor.templates")
+
+TEMPLATES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"
+)
+
+
+def _bytecode_cache(directory: str) -> Optional[jinja2.BytecodeCache]:
+    """Cache compiled templates on disk, if the directory is writable"""
+    try:
+        os.makedirs(directory, exist_ok=True)
+        return jinja2.FileSystemBytecodeCache(directory)
+    except OSError as e:
+        logger.warning(f"Template bytecode cache disabled: {str(e)}")
+        return None
+
+
+def get_template(kind: str, device_type: str, extension: str) -> jinja2.Template:
+    """Get the template for a device type, falling back to the generic one"""
+    return template_env.select_template(
+        [f"{kind}_{device_type}.{extension}.j2", f"{kind}_generic.{extension}.j2"]
+    )
+
+
+# Initialize the shared template environment. Templates are compiled once
+# and recompiled when their file changes.
+template_env = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+    bytecode_cache=_bytecode_cache(os.path.join(settings.cache_dir, "templates")),
+    auto_reload=True,
+)
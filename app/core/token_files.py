@@ -0,0 +1,57 @@
+import logging
+import os
+from typing import Set
+
+from app.core.config import settings
+
+logger = logging.getLogger("api-monitor.token-files")
+
+
+def token_file_path(device_name: str) -> str:
+    """Path of a device's token file as written by API Monitor"""
+    return os.path.join(settings.token_dir, f"{device_name}.token")
+
+
+def telegraf_token_file_path(device_name: str) -> str:
+    """Path of a device's token file as seen by Telegraf"""
+    return os.path.join(settings.telegraf_token_dir, f"{device_name}.token")
+
+
+def write_token_file(device_name: str, token: str) -> None:
+    """
+    Atomically replace a device's token file
+
+    Telegraf reads the file on every request through the bearer_token
+    option, so a renewed token takes effect without a restart.
+    """
+    path = token_file_path(device_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(token)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logger.debug(f"Wrote token file for {device_name}")
+
+
+def token_file_devices() -> Set[str]:
+    """Names of the devices that have a token file"""
+    try:
+        file_names = os.listdir(settings.token_dir)
+    except FileNotFoundError:
+        return set()
+    return {
+        file_name[: -len(".token")]
+        for file_name in file_names
+        if file_name.endswith(".token")
+    }
+
+
+def remove_token_file(device_name: str) -> None:
+    """Remove a device's token file, if it has one"""
+    try:
+        os.remove(token_file_path(device_name))
+        logger.info(f"Removed token file for {device_name}")
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+logger = logging.getLogger("api-monitor.token-store")
+
+
+class TokenStore:
+    """
+    Persistent store of OpenID Connect tokens, keyed by device name
+
+    The file is read once and kept in memory; async callers load it with
+    load() so the read happens in a worker thread. Updates are written by a
+    single writer task, debounced so a burst of token refreshes results in
+    one write. Each write takes an exclusive file lock, merges in entries
+    written by other processes, and atomically replaces the file with an
+    fsync'd copy, so a crash never leaves a truncated store behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+        self._dirty: Set[str] = set()
+        self._writer: Optional[asyncio.Task] = None
+        self._write_now: Optional[asyncio.Event] = None
+
+    async def load(self) -> None:
+        """Load the store from disk off the event loop, unless already loaded"""
+        if self._entries is None:
+            await asyncio.to_thread(self._load)
+
+    def get(self, device_name: str) -> Optional[Dict[str, Any]]:
+        """Get the stored tokens of a device"""
+        return self._load().get(device_name)
+
+    def set(self, device_name: str, token_data: Dict[str, Any]) -> None:
+        """Store the tokens of a device and schedule a write"""
+        self._load()[device_name] = token_data
+        self._dirty.add(device_name)
+        self._schedule_write()
+
+    async def flush(self) -> None:
+        """Write pending updates now"""
+        if self._writer is not None and not self._writer.done():
+            # Let the writer finish a write in progress rather than cancel it
+            self._write_now.set()
+            await self._writer
+        self._writer = None
+        if self._dirty:
+            await self._persist()
+
+    def _schedule_write(self) -> None:
+        """Start the writer task unless a write is already pending"""
+        if self._writer is not None and not self._writer.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop, e.g. in a script: write right away
+            dirty, entries = self._pending()
+            self._finish_write(dirty, *self._write(dirty, entries))
+            return
+        self._write_now = asyncio.Event()
+        self._writer = loop.create_task(self._write_later())
+
+    async def _write_later(self) -> None:
+        try:
+            await asyncio.wait_for(
+                self._write_now.wait(), settings.token_store_write_delay
+            )
+        except asyncio.TimeoutError:
+            pass
+        # Updates made while a write was in progress are written next
+        while self._dirty:
+            if not await self._persist():
+                break
+
+    async def _persist(self) -> bool:
+        """Write the pending updates off the event loop"""
+        dirty, entries = self._pending()
+        try:
+            result = await asyncio.to_thread(self._write, dirty, entries)
+        except asyncio.CancelledError:
+            self._dirty.update(dirty)
+            raise
+        return self._finish_write(dirty, *result)
+
+    def _pending(self) -> Tuple[Set[str], Dict[str, Dict[str, Any]]]:
+        """Take the devices to write and a snapshot of the entries"""
+        dirty = set(self._dirty)
+        self._dirty.clear()
+        return dirty, dict(self._load())
+
+    def _finish_write(
+        self, dirty: Set[str], saved: bool, on_disk: Dict[str, Dict[str, Any]]
+    ) -> bool:
+        """Take in the entries other processes wrote, or retry a failed write"""
+        if not saved:
+            # Retry with the next write
+            self._dirty.update(dirty)
+            return False
+        for device_name, token_data in on_disk.items():
+            # Devices updated since the snapshot keep their newer tokens
+            if device_name not in self._dirty:
+                self._entries[device_name] = token_data
+        return True
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Load the store from disk on first use"""
+        if self._entries is None:
+            entries = {}
+            if os.path.exists(self.path):
+                try:
+                    with self._locked(exclusive=False):
+                        entries = self._read()
+                    logger.info("Loaded token store from disk")
+                except Exception as e:
+                    logger.error(f"Error loading token store: {str(e)}")
+            # Another load may have finished first
+            if self._entries is None:
+                self._entries = entries
+        return self._entries
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+
+    def _write(
+        self, dirty: Set[str], entries: Dict[str, Dict[str, Any]]
+    ) -> Tuple[bool, Dict[str, Dict[str, Any]]]:
+        """
+        Merge and atomically write a snapshot of the store
+
+        Returns whether the write succeeded, and the entries other processes
+        wrote that were merged in.
+        """
+        try:
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            with self._locked(exclusive=True):
+                # Keep entries other processes wrote since the store was loaded
+                try:
+                    on_disk = self._read()
+                except ValueError:
+                    on_disk = {}
+                merged = {
+                    device_name: token_data
+                    for device_name, token_data in on_disk.items()
+                    if device_name not in dirty
+                }
+                entries.update(merged)
+
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(entries, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                _fsync_directory(directory)
+            logger.info("Saved token store to disk")
+            return True, merged
+        except Exception as e:
+            logger.error(f"Error saving token store: {str(e)}")
+            return False, {}
+
+    @contextmanager
+    def _locked(self, exclusive: bool) -> Iterator[None]:
+        """Hold an advisory lock shared by every process using the store"""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _fsync_directory(directory: str) -> None:
+    """Persist a rename by syncing its directory, where supported"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Initialize the shared store
+token_store = TokenStore(settings.token_store_path)
@@ -1,70 +1,102 @@
 #!/usr/bin/env python3
+import hashlib
 import json
 import logging
 import os
+import threading
 import uuid
 
 import jinja2
+from jinja2 import meta
+
+from app.core.metric_names import (
+    HEALTH_AVAILABILITY_RECORD,
+    HEALTH_UP_RECORD,
+    RESPONSE_TIME_QUANTILES,
+    RESPONSE_TIME_RECORD,
+    ROLLUP_AGGREGATION,
+    TYPE_ROLLUP_AGGREGATIONS,
+    metric_group,
+    metric_selector,
+    rollup_record,
+    selector,
+    series_name,
+    type_rollup_record,
+)
+from app.core.polled_endpoints import polled_endpoints
+from app.core.templates import get_template, template_env
 
 logger = logging.getLogger("api-monitor.dashboard-generator")
 
+# Namespace of the dashboard UIDs, derived from the device name
+DASHBOARD_UID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "api-monitor/dashboards")
 
-class GrafanaDashboardGenerator:
-    def __init__(self, device_config, api_structure):
-        self.device_config = device_config
-        self.api_structure = api_structure
+# Template variable selecting the devices of a type dashboard
+DEVICE_VARIABLE = "device"
 
-        # Ensure global configuration exists
-        if "global" not in self.device_config:
-            self.device_config["global"] = {}
+# Placeholders the cached skeletons are rendered with
+_PLACEHOLDERS = {
+    "device_name": "@@api-monitor:device_name@@",
+    "device_type": "@@api-monitor:device_type@@",
+    "title": "@@api-monitor:title@@",
+    "uid": "@@api-monitor:uid@@",
+    "panels": "@@api-monitor:panels@@",
+}
 
-        self.template_loader = jinja2.FileSystemLoader(
-            searchpath=os.path.join(os.path.dirname(__file__), "templates")
-        )
-        self.template_env = jinja2.Environment(loader=self.template_loader)
+# Variables a template may use and still be rendered once per device type
+_SKELETON_VARIABLES = {"device", "device_name", "title", "uid", "panels"}
+
+# Parsed skeleton per template, None for templates rendered per device
+_skeletons = {}
+_skeletons_lock = threading.Lock()
+
+
+class _NotCacheable(Exception):
+    """A template used device details beyond its name and type"""
+
+
+class _PlaceholderDevice:
+    """Stands in for a device when rendering a skeleton"""
+
+    name = _PLACEHOLDERS["device_name"]
+    type = _PLACEHOLDERS["device_type"]
+
+    def __getattr__(self, key):
+        raise _NotCacheable(key)
+
+
+class GrafanaDashboardGenerator:
+    # Width of the metric and health panels, out of Grafana's 24 columns
+    PANEL_WIDTH = 12
+    HEALTH_PANEL_WIDTH = 8
+
+    def __init__(self, device, api_structure):
+        self.device = device
+        self.api_structure = api_structure
+        self._panel_ids = set()
 
     def generate(self):
         """Generate Grafana dashboard for the device"""
-        device_type = self.device_config.get("type", "generic")
-        device_name = self.device_config.get("name", "device")
+        device_type = self.device.type
+        device_name = self.device.name
 
-        # Try to find a template for this device type
-        try:
-            template = self.template_env.get_template(
-                f"dashboard_{device_type}.json.j2"
-            )
-        except jinja2.exceptions.TemplateNotFound:
-            # Fallback to generic template
-            template = self.template_env.get_template("dashboard_generic.json.j2")
+        # Use the template for this device type, or the generic one
+        template = get_template("dashboard", device_type, "json")
 
         # Generate panels based on discovered metrics
+        self._panel_ids = set()
         panels = []
         y_pos = 0
 
         # Add a header panel with device information
-        header_panel = {
-            "type": "text",
-            "title": f"{device_name} Overview",
-            "gridPos": {"x": 0, "y": y_pos, "w": 24, "h": 3},
-            "id": self._generate_id(),
-            "options": {
-                "mode": "markdown",
-                "content": f"""# {device_name} ({device_type})
-                
-**Description**: {self.device_config.get('description', 'No description')}
-                
-**Status**: Data from {len(self.api_structure.get('endpoints', []))} endpoints""",
-            },
-        }
-        panels.append(header_panel)
+        panels.append(self._header_panel(y_pos))
         y_pos += 3
 
         # Add status panel
         status_panel = {
             "type": "stat",
             "title": "Device Status",
-            "gridPos": {"x": 0, "y": y_pos, "w": 24, "h": 4},
-            "id": self._generate_id(),
+            "id": self._generate_id("status"),
             "options": {
                 "colorMode": "value",
                 "graphMode": "area",
@@ -94,14 +126,30 @@ class GrafanaDashboardGenerator:
             },
             "targets": [
                 {
-                    "expr": f'device_health_response_status_code{{device_name="{device_name}", url=~".*"}} / 100',
+                    # Recorded from the result of the http_response check
+                    "expr": selector(HEALTH_UP_RECORD, {"device_name": device_name}),
                     "refId": "A",
                     "legendFormat": "Status",
                 }
             ],
         }
-        panels.append(status_panel)
-        y_pos += 4
+
+        # Lay out the health panels side by side
+        health_panels = [
+            status_panel,
+            self._availability_panel(),
+            self._response_time_panel(),
+        ]
+        columns = 24 // self.HEALTH_PANEL_WIDTH
+        for i, panel in enumerate(health_panels):
+            panel["gridPos"] = {
+                "x": i % columns * self.HEALTH_PANEL_WIDTH,
+                "y": y_pos + i // columns * 6,
+                "w": self.HEALTH_PANEL_WIDTH,
+                "h": 6,
+            }
+            panels.append(self._repeated(panel))
+        y_pos += -(-len(health_panels) // columns) * 6
 
         # Group metrics into logical sections
         metric_groups = self._group_metrics()
@@ -114,67 +162,176 @@ class GrafanaDashboardGenerator:
                     "type": "row",
                     "title": group_name,
                     "gridPos": {"x": 0, "y": y_pos, "w": 24, "h": 1},
-                    "id": self._generate_id(),
+                    "id": self._generate_id(f"row:{group_name}"),
                     "collapsed": False,
                 }
             )
             y_pos += 1
 
             # Create panels for the metrics in this group
-            for i, metric in enumerate(metrics):
+            columns = 24 // self.PANEL_WIDTH
+            for i, (endpoint_path, metric) in enumerate(metrics):
                 panel = self._create_panel_for_metric(
-                    metric, i % 2 * 12, y_pos, group_name
+                    metric,
+                    endpoint_path,
+                    i % columns * self.PANEL_WIDTH,
+                    y_pos,
+                    group_name,
                 )
-                panels.append(panel)
+                panels.append(self._repeated(panel))
 
-                # Move to next row every 2 panels
-                if i % 2 == 1:
+                # Move to next row once the columns are filled
+                if i % columns == columns - 1:
                     y_pos += 8
+            if len(metrics) % columns:
+                y_pos += 8
+
+        # Add the panels aggregating the metrics across devices
+        panels.extend(self._aggregate_panels(metric_groups, y_pos))
+
+        values = self._values()
+
+        # Fill the skeleton of the template, rendered once per device type
+        skeleton = _skeleton(template)
+        if skeleton is not None:
+            return _fill(skeleton, values, panels)
+
+        # Templates using other device details are rendered for each device
+        dashboard_json = template.render(
+            device=self.device,
+            api=self.api_structure,
+            panels=panels,
+            uid=values["uid"],
+            title=values["title"],
+            device_name=device_name,
+        )
+        return json.loads(dashboard_json)
 
-        # Prepare template variables
-        template_vars = {
-            "device": self.device_config,
-            "api": self.api_structure,
-            "panels": panels,
-            "uid": str(uuid.uuid4()),
-            "title": f"{device_name} Dashboard",
+    def _header_panel(self, y_pos):
+        """Create the text panel describing the device"""
+        device_name = self.device.name
+        return {
+            "type": "text",
+            "title": f"{device_name} Overview",
+            "gridPos": {"x": 0, "y": y_pos, "w": 24, "h": 3},
+            "id": self._generate_id("header"),
+            "options": {
+                "mode": "markdown",
+                "content": f"""# {device_name} ({self.device.type})
+                
+**Description**: {self.device.description or 'No description'}
+                
+**Status**: Data from {len(self._endpoints())} endpoints""",
+            },
+        }
+
+    def _availability_panel(self):
+        """Create the panel showing the share of successful health checks"""
+        return {
+            "type": "stat",
+            "title": "Availability (1h)",
+            "id": self._generate_id("availability"),
+            "options": {
+                "colorMode": "value",
+                "graphMode": "area",
+                "justifyMode": "auto",
+                "textMode": "auto",
+            },
+            "fieldConfig": {
+                "defaults": {
+                    "unit": "percentunit",
+                    "min": 0,
+                    "max": 1,
+                    "thresholds": {
+                        "mode": "absolute",
+                        "steps": [
+                            {"value": None, "color": "red"},
+                            {"value": 0.95, "color": "yellow"},
+                            {"value": 0.99, "color": "green"},
+                        ],
+                    },
+                    "color": {"mode": "thresholds"},
+                }
+            },
+            "targets": [
+                {
+                    "expr": selector(
+                        HEALTH_AVAILABILITY_RECORD, {"device_name": self.device.name}
+                    ),
+                    "refId": "A",
+                    "legendFormat": "Availability",
+                }
+            ],
+        }
+
+    def _response_time_panel(self):
+        """Create the panel showing the recorded response time quantiles"""
+        return {
+            "type": "timeseries",
+            "title": "Response Time",
+            "id": self._generate_id("response_time"),
+            "fieldConfig": {"defaults": {"unit": "s"}},
+            "targets": [
+                {
+                    "expr": selector(
+                        RESPONSE_TIME_RECORD.format(quantile=quantile),
+                        {"device_name": self.device.name},
+                    ),
+                    "refId": chr(ord("A") + i),
+                    "legendFormat": f"p{quantile}",
+                }
+                for i, quantile in enumerate(RESPONSE_TIME_QUANTILES)
+            ],
+        }
+
+    def _values(self):
+        """Get the values filled into the dashboard template"""
+        device_name = self.device.name
+        return {
             "device_name": device_name,  # Explicitly pass device name for filtering
+            "device_type": self.device.type,
+            "title": f"{device_name} Dashboard",
+            "uid": str(uuid.uuid5(DASHBOARD_UID_NAMESPACE, device_name)),
         }
 
-        # Render the template
-        dashboard_json = template.render(**template_vars)
-        return json.loads(dashboard_json)
+    def _repeated(self, panel):
+        """Hook for panels shown once per device"""
+        return panel
+
+    def _aggregate_panels(self, metric_groups, y_pos):
+        """Hook for panels charting metrics across devices"""
+        return []
+
+    def _endpoints(self):
+        """Get the endpoints whose series Telegraf collects"""
+        return polled_endpoints(self.device, self.api_structure)
 
     def _group_metrics(self):
-        """Group metrics into logical sections based on paths"""
+        """Group metrics, with the path of their endpoint, into logical sections"""
         metric_groups = {}
 
-        # Process all endpoints
-        for endpoint in self.api_structure.get("endpoints", []):
+        # Process the endpoints Telegraf polls
+        for endpoint in self._endpoints():
             metrics = endpoint.get("metrics", [])
+            # Tag value the Telegraf input sets for the endpoint
+            endpoint_path = endpoint.get("path") or "/"
 
             for metric in metrics:
                 # Try to extract a group name from the path
-                parts = metric["path"].split(".")
-
-                if len(parts) > 1:
-                    group_name = parts[0].title()
-                else:
-                    group_name = "General"
+                group_name = metric_group(metric["path"])
 
                 if group_name not in metric_groups:
                     metric_groups[group_name] = []
 
-                metric_groups[group_name].append(metric)
+                metric_groups[group_name].append((endpoint_path, metric))
 
         return metric_groups
 
-    def _create_panel_for_metric(self, metric, x_pos, y_pos, group_name):
+    def _create_panel_for_metric(self, metric, endpoint_path, x_pos, y_pos, group_name):
         """Create a Grafana panel for a metric"""
         metric_name = metric["name"]
         metric_path = metric["path"]
         metric_type = metric["type"]
-        device_name = self.device_config.get("name", "device")
 
         # Determine the best visualization based on the metric type
         if metric_type in ["int", "float"]:
@@ -184,14 +341,14 @@ class GrafanaDashboardGenerator:
 
         # Create the panel configuration
         panel = {
-            "id": self._generate_id(),
+            "id": self._generate_id(f"metric:{endpoint_path}:{metric_path}"),
             "title": metric_name.replace("_", " ").title(),
             "type": panel_type,
-            "gridPos": {"x": x_pos, "y": y_pos, "w": 12, "h": 8},
+            "gridPos": {"x": x_pos, "y": y_pos, "w": self.PANEL_WIDTH, "h": 8},
             "targets": [
                 {
-                    # For our simplified metrics approach, search for any metrics with the device name
-                    "expr": f'{{device_name="{device_name}"}}',
+                    # Only the series of this metric, not every series of the device
+                    "expr": self._metric_expr(metric_path, endpoint_path),
                     "refId": "A",
                     "legendFormat": "{{__name__}}",
                 }
@@ -213,15 +370,275 @@ class GrafanaDashboardGenerator:
 
         return panel
 
-    def _generate_id(self):
-        """Generate a unique ID for a panel"""
-        return int(uuid.uuid4().hex[:8], 16) & 0x7FFFFFFF
-
-    def save_dashboard(self, filename):
-        """Save the generated dashboard to a file"""
+    def _metric_expr(self, metric_path, endpoint_path):
+        """Query a metric, through its recorded rollup for array elements"""
+        _, is_regex = series_name(metric_path)
+        if is_regex:
+            return selector(
+                rollup_record(metric_path, ROLLUP_AGGREGATION),
+                {"device_name": self.device.name, "endpoint": endpoint_path},
+            )
+        return metric_selector(metric_path, self.device.name, endpoint_path)
+
+    def _generate_id(self, key):
+        """
+        Derive a stable panel ID from the device name and the panel's key
+
+        The same panel keeps its ID across runs. Hash collisions within
+        the dashboard move to the next free ID in the order the panels are
+        created.
+        """
+        digest = hashlib.sha256(f"{self.device.name}\x00{key}".encode("utf-8"))
+        panel_id = int.from_bytes(digest.digest()[:4], "big") & 0x7FFFFFFF
+        while panel_id == 0 or panel_id in self._panel_ids:
+            panel_id = (panel_id + 1) & 0x7FFFFFFF
+        self._panel_ids.add(panel_id)
+        return panel_id
+
+    def save_dashboard(self, filename, dashboard=None):
+        """Save a dashboard to a file, generating it unless it is given"""
+        if dashboard is None:
+            dashboard = self.generate()
         os.makedirs(os.path.dirname(filename), exist_ok=True)
 
+        # json.dumps uses the C encoder, json.dump never does
         with open(filename, "w") as f:
-            json.dump(self.generate(), f, indent=2)
+            f.write(json.dumps(dashboard, separators=(",", ":")))
 
         logger.info(f"Saved Grafana dashboard to {filename}")
+
+
+class _TypeDevice:
+    """Stands in for the devices of a type, selected through the template variable"""
+
+    def __init__(self, device_type):
+        self.name = f"${DEVICE_VARIABLE}"
+        self.type = device_type
+        self.description = None
+
+
+class GrafanaTypeDashboardGenerator(GrafanaDashboardGenerator):
+    """
+    Generates one dashboard for all devices of a type
+
+    The panels query the devices selected in the device template variable
+    and are repeated for each of them, so a single dashboard covers the
+    union of the metrics discovered across the devices of the type. Extra
+    panels chart the recorded averages and sums of each metric over the
+    whole type.
+    """
+
+    # Repeated panels share the width of the dashboard
+    PANEL_WIDTH = 24
+    HEALTH_PANEL_WIDTH = 24
+    # Width of the panels aggregating the type
+    AGGREGATE_PANEL_WIDTH = 12
+    MAX_PER_ROW = 4
+
+    def __init__(self, device_type, device_metrics):
+        super().__init__(_TypeDevice(device_type), _merge_metrics(device_metrics))
+        self.device_type = device_type
+        self.device_names = sorted(device_metrics)
+
+    def generate(self):
+        """Generate the Grafana dashboard of the device type"""
+        dashboard = super().generate()
+        dashboard["tags"] = [
+            tag for tag in dashboard.get("tags", []) if tag != self.device.name
+        ]
+
+        # Offer every device of the type, all of them shown by default
+        query = f"label_values({selector(HEALTH_UP_RECORD, {'device_type': self.device_type})}, device_name)"
+        updates = {
+            "definition": query,
+            "query": {"query": query, "refId": "StandardVariableQuery"},
+            "multi": True,
+            "includeAll": True,
+            "current": {"selected": True, "text": ["All"], "value": ["$__all"]},
+        }
+        variables = dashboard.setdefault("templating", {}).setdefault("list", [])
+        for variable in variables:
+            if variable.get("name") == DEVICE_VARIABLE:
+                variable.update(updates)
+                break
+        else:
+            variables.append(
+                {
+                    "datasource": "Prometheus",
+                    "hide": 0,
+                    "label": "Device",
+                    "name": DEVICE_VARIABLE,
+                    "refresh": 1,
+                    "sort": 1,
+                    "type": "query",
+                    **updates,
+                }
+            )
+        return dashboard
+
+    def _header_panel(self, y_pos):
+        """Create the text panel describing the device type"""
+        return {
+            "type": "text",
+            "title": f"{self.device_type} Overview",
+            "gridPos": {"x": 0, "y": y_pos, "w": 24, "h": 3},
+            "id": self._generate_id("header"),
+            "options": {
+                "mode": "markdown",
+                "content": f"""# {self.device_type} devices
+
+**Devices**: {', '.join(self.device_names) or 'None'}
+
+**Status**: Data from {len(self._endpoints())} endpoints""",
+            },
+        }
+
+    def _values(self):
+        """Get the values filled into the dashboard template"""
+        return {
+            "device_name": self.device.name,
+            "device_type": self.device_type,
+            "title": f"{self.device_type} Dashboard",
+            "uid": str(uuid.uuid5(DASHBOARD_UID_NAMESPACE, f"type:{self.device_type}")),
+        }
+
+    def _endpoints(self):
+        """Get the endpoints, merged from the polled endpoints of each device"""
+        return self.api_structure.get("endpoints", [])
+
+    def _aggregate_panels(self, metric_groups, y_pos):
+        """Create a panel per metric charting its average and sum over the type"""
+        metrics = [metric for group in metric_groups.values() for metric in group]
+        if not metrics:
+            return []
+
+        panels = [
+            {
+                "type": "row",
+                "title": f"{self.device_type} Rollups",
+                "gridPos": {"x": 0, "y": y_pos, "w": 24, "h": 1},
+                "id": self._generate_id("row:rollups"),
+                "collapsed": False,
+            }
+        ]
+        y_pos += 1
+
+        columns = 24 // self.AGGREGATE_PANEL_WIDTH
+        for i, (endpoint_path, metric) in enumerate(metrics):
+            panels.append(
+                {
+                    "id": self._generate_id(f"rollup:{endpoint_path}:{metric['path']}"),
+                    "title": f"{metric['name'].replace('_', ' ').title()} - {self.device_type}",
+                    "type": "timeseries",
+                    "gridPos": {
+                        "x": i % columns * self.AGGREGATE_PANEL_WIDTH,
+                        "y": y_pos + i // columns * 8,
+                        "w": self.AGGREGATE_PANEL_WIDTH,
+                        "h": 8,
+                    },
+                    "targets": [
+                        {
+                            "expr": selector(
+                                type_rollup_record(metric["path"], aggregation),
+                                {
+                                    "device_type": self.device_type,
+                                    "endpoint": endpoint_path,
+                                },
+                            ),
+                            "refId": chr(ord("A") + j),
+                            "legendFormat": aggregation,
+                        }
+                        for j, aggregation in enumerate(TYPE_ROLLUP_AGGREGATIONS)
+                    ],
+                }
+            )
+        return panels
+
+    def _repeated(self, panel):
+        """Repeat a panel for each selected device"""
+        panel["title"] = f"{panel['title']} - {self.device.name}"
+        panel["repeat"] = DEVICE_VARIABLE
+        panel["repeatDirection"] = "h"
+        panel["maxPerRow"] = self.MAX_PER_ROW
+        return panel
+
+
+def dashboard_metrics(device, api_structure):
+    """Get the metrics a dashboard shows, with the path of their endpoint"""
+    return [
+        {
+            "endpoint": endpoint.get("path") or "/",
+            "path": metric["path"],
+            "name": metric["name"],
+            "type": metric["type"],
+        }
+        for endpoint in polled_endpoints(device, api_structure)
+        for metric in endpoint.get("metrics", [])
+    ]
+
+
+def _merge_metrics(device_metrics):
+    """Build an api_structure from the union of the metrics of several devices"""
+    endpoints = {}
+    for device_name in sorted(device_metrics):
+        for metric in device_metrics[device_name]:
+            metrics = endpoints.setdefault(metric["endpoint"], {})
+            metrics.setdefault(metric["path"], metric)
+    return {
+        "endpoints": [
+            {"path": path, "metrics": list(metrics.values())}
+            for path, metrics in endpoints.items()
+        ]
+    }
+
+
+def _skeleton(template):
+    """
+    Get the parsed skeleton of a dashboard template
+
+    The template is rendered once with placeholders and parsed, so each
+    dashboard only fills in its values. Templates are cached by identity,
+    and auto_reload replaces the template object when its file changes.
+    Templates that use more than the device name and type get None.
+    """
+    with _skeletons_lock:
+        if template in _skeletons:
+            return _skeletons[template]
+
+    skeleton = None
+    try:
+        source = template_env.loader.get_source(template_env, template.name)[0]
+        variables = meta.find_undeclared_variables(template_env.parse(source))
+        if variables <= _SKELETON_VARIABLES:
+            skeleton = json.loads(
+                template.render(
+                    device=_PlaceholderDevice(),
+                    device_name=_PLACEHOLDERS["device_name"],
+                    title=_PLACEHOLDERS["title"],
+                    uid=_PLACEHOLDERS["uid"],
+                    panels=_PLACEHOLDERS["panels"],
+                )
+            )
+    except (_NotCacheable, jinja2.TemplateError):
+        skeleton = None
+
+    with _skeletons_lock:
+        # Forget skeletons of replaced templates
+        for cached in [t for t in _skeletons if t.name == template.name]:
+            del _skeletons[cached]
+        _skeletons[template] = skeleton
+    return skeleton
+
+
+def _fill(node, values, panels):
+    """Copy a skeleton, replacing its placeholders"""
+    if isinstance(node, dict):
+        return {key: _fill(value, values, panels) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_fill(value, values, panels) for value in node]
+    if isinstance(node, str) and "@@api-monitor:" in node:
+        if node == _PLACEHOLDERS["panels"]:
+            return panels
+        for key, value in values.items():
+            node = node.replace(_PLACEHOLDERS[key], value)
+    return node
@@ -2,12 +2,15 @@
 import logging
 from contextlib import asynccontextmanager
 
-from fastapi import BackgroundTasks, FastAPI
+from fastapi import FastAPI
 
 from app.api.routes import api_router
 from app.core.config import settings
 from app.core.errors import setup_exception_handlers
-from app.core.tasks import start_background_tasks
+from app.core.http_pool import http_pool
+from app.core.spec_validation import spec_validator
+from app.core.tasks import start_background_tasks, stop_background_tasks
+from app.core.token_store import token_store
 
 # Configure logging
 logging.basicConfig(
@@ -26,15 +29,21 @@ async def lifespan(app: FastAPI):
     - Startup: Initialize background tasks
     - Shutdown: Cleanup resources
     """
+    # Startup: Load the persisted tokens off the event loop
+    await token_store.load()
+
     # Startup: Process devices and set up periodic refresh
-    background_tasks = BackgroundTasks()
-    await start_background_tasks(background_tasks)
+    background_tasks = await start_background_tasks()
 
     logger.info("API Monitor started successfully")
     yield
 
     # Shutdown: Clean up resources if needed
     logger.info("Shutting down API Monitor")
+    await stop_background_tasks(background_tasks)
+    await token_store.flush()
+    await http_pool.close()
+    spec_validator.shutdown()
 
 
 def create_application() -> FastAPI:
@@ -100,8 +100,8 @@ async def process_devices(background_tasks):
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(token_env_path), exist_ok=True)
 
-        exporter = TokenExporter(config_path, token_env_path)
-        if exporter.run():
+        exporter = TokenExporter(config_path)
+        if await exporter.run():
             logger.info("Successfully exported device tokens")
         else:
             logger.warning("Failed to export some device tokens")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import yaml
+
+from app.core.metric_names import (
+    HEALTH_AVAILABILITY_RECORD,
+    HEALTH_MEASUREMENT,
+    HEALTH_UP_RECORD,
+    RESPONSE_TIME_QUANTILES,
+    RESPONSE_TIME_RECORD,
+    ROLLUP_AGGREGATION,
+    TYPE_ROLLUP_AGGREGATIONS,
+    rollup_record,
+    selector,
+    series_name,
+    type_rollup_record,
+)
+from app.core.polled_endpoints import polled_endpoints
+
+# Labels every recorded series keeps
+DEVICE_LABELS = "device_name, device_type"
+
+
+class PrometheusRulesGenerator:
+    """
+    Generates Prometheus recording rules for a device
+
+    Dashboards query the recorded series instead of aggregating raw series
+    on every refresh: one series per array metric, averaged across its
+    elements. Only series the dashboards read are recorded.
+    """
+
+    def __init__(self, device, api_structure):
+        self.device = device
+        self.api_structure = api_structure
+
+    def generate(self):
+        """Generate the rules file of the device"""
+        device_name = self.device.name
+        rules = []
+        rollups = set()
+
+        # Only series Telegraf collects, as charted on the dashboards
+        for endpoint in polled_endpoints(self.device, self.api_structure):
+            # Tag value the Telegraf input sets for the endpoint
+            endpoint_path = endpoint.get("path") or "/"
+            for metric in endpoint.get("metrics", []):
+                name, is_regex = series_name(metric["path"])
+                if not is_regex or (metric["path"], endpoint_path) in rollups:
+                    continue
+                rollups.add((metric["path"], endpoint_path))
+
+                # Aggregate the elements of array metrics
+                series = selector(
+                    name, {"device_name": device_name, "endpoint": endpoint_path}, True
+                )
+                rules.append(
+                    {
+                        "record": rollup_record(metric["path"], ROLLUP_AGGREGATION),
+                        "expr": f"{ROLLUP_AGGREGATION} by ({DEVICE_LABELS}, endpoint) ({series})",
+                    }
+                )
+
+        if not rules:
+            return _dump([])
+        return _dump([{"name": f"api-monitor-device-{device_name}", "rules": rules}])
+
+    @staticmethod
+    def generate_type(device_type, device_metrics):
+        """
+        Generate the rules file of a device type
+
+        Each metric charted on the type dashboard is recorded averaged and
+        summed across the devices of the type, and the elements of arrays.
+        device_metrics holds the dashboard metrics of each device by name.
+        """
+        rules = []
+        recorded = set()
+        for device_name in sorted(device_metrics):
+            for metric in device_metrics[device_name]:
+                if (metric["path"], metric["endpoint"]) in recorded:
+                    continue
+                recorded.add((metric["path"], metric["endpoint"]))
+
+                name, is_regex = series_name(metric["path"])
+                series = selector(
+                    name,
+                    {"device_type": device_type, "endpoint": metric["endpoint"]},
+                    is_regex,
+                )
+                for aggregation in TYPE_ROLLUP_AGGREGATIONS:
+                    rules.append(
+                        {
+                            "record": type_rollup_record(metric["path"], aggregation),
+                            "expr": f"{aggregation} by (device_type, endpoint) ({series})",
+                        }
+                    )
+
+        if not rules:
+            return _dump([])
+        return _dump([{"name": f"api-monitor-type-{device_type}", "rules": rules}])
+
+    @staticmethod
+    def generate_base():
+        """Generate the health rules shared by all devices"""
+        rules = [
+            {
+                # http_response reports result_code 0 for a successful check
+                "record": HEALTH_UP_RECORD,
+                "expr": f"max by ({DEVICE_LABELS}) ({HEALTH_MEASUREMENT}_result_code == bool 0)",
+            },
+            {
+                "record": HEALTH_AVAILABILITY_RECORD,
+                "expr": f"avg_over_time({HEALTH_UP_RECORD}[1h])",
+            },
+        ]
+        for quantile in RESPONSE_TIME_QUANTILES:
+            rules.append(
+                {
+                    "record": RESPONSE_TIME_RECORD.format(quantile=quantile),
+                    "expr": (
+                        f"max by ({DEVICE_LABELS}) (quantile_over_time("
+                        f"{quantile / 100}, {HEALTH_MEASUREMENT}_response_time[5m]))"
+                    ),
+                }
+            )
+        return _dump([{"name": "api-monitor-health", "rules": rules}])
+
+
+def _dump(groups):
+    """Serialize rule groups as a Prometheus rules file"""
+    return "# Generated automatically - DO NOT EDIT MANUALLY\n" + yaml.safe_dump(
+        {"groups": groups}, sort_keys=False, width=1000
+    )
@@ -1,63 +1,189 @@
 import asyncio
 import logging
 import os
-from typing import Any, Dict, List, Set
+from typing import Any, Dict, List, Optional, Set
 
 from app.config_generator import TelegrafConfigGenerator
+from app.core.build_manifest import BuildManifest
 from app.core.config import settings
-from app.core.device_config import AttributeDict, get_device_names, get_devices
+from app.core.device_config import ConfigSnapshot, load_snapshot
+from app.core.device_model import Device
 from app.core.errors import ConfigurationError, DeviceError
-from app.dashboard_generator import GrafanaDashboardGenerator
+from app.core.generations import (
+    GRAFANA,
+    PROMETHEUS,
+    TELEGRAF,
+    GenerationRun,
+    list_generations,
+    rollback,
+)
+from app.core.http_pool import http_pool
+from app.dashboard_generator import (
+    GrafanaDashboardGenerator,
+    GrafanaTypeDashboardGenerator,
+    dashboard_metrics,
+)
 from app.discovery import ApiDiscovery
+from app.rules_generator import PrometheusRulesGenerator
 from app.token_exporter import TokenExporter
 
 logger = logging.getLogger("api-monitor.device-service")
 
+# Outcomes of processing a single device
+SKIPPED = "skipped"
+REGENERATED = "regenerated"
+FAILED = "failed"
+
+# One dashboard per device, or one per device type
+DASHBOARD_MODES = ("device", "type")
+
+# Runs and rollbacks switch the live generation one at a time
+_generation_lock = asyncio.Lock()
+
 
 class DeviceService:
     """Service for device operations"""
 
     @staticmethod
-    async def process_devices() -> Dict[str, int]:
-        """Process all devices and generate configurations"""
-        # Get device names for cleanup
-        current_device_names = get_device_names()
+    async def process_devices(
+        snapshot: Optional[ConfigSnapshot] = None, only: Optional[Set[str]] = None
+    ) -> Dict[str, int]:
+        """
+        Process devices and generate configurations
+
+        By default every device is processed. With only, the other devices
+        keep their live outputs without being discovered again.
+        """
+        async with _generation_lock:
+            run = GenerationRun()
+            try:
+                await run.start()
+                counts = await DeviceService._generate(run, snapshot, only)
+                published = await run.publish()
+            except Exception:
+                await run.discard()
+                raise
+            if published:
+                await DeviceService._reload_prometheus()
+
+        successful_devices = counts[SKIPPED] + counts[REGENERATED]
+        logger.info(
+            f"Device processing complete. Successful: {successful_devices}, Failed: {counts[FAILED]} "
+            f"(skipped: {counts[SKIPPED]}, regenerated: {counts[REGENERATED]})"
+        )
+        return {
+            "successful": successful_devices,
+            "failed": counts[FAILED],
+            "skipped": counts[SKIPPED],
+            "regenerated": counts[REGENERATED],
+        }
 
-        # Clean up removed devices
-        await DeviceService._cleanup_removed_devices(current_device_names)
+    @staticmethod
+    async def _generate(
+        run: GenerationRun,
+        snapshot: Optional[ConfigSnapshot] = None,
+        only: Optional[Set[str]] = None,
+    ) -> Dict[str, int]:
+        """Generate the outputs of devices into a staged generation"""
+        # Parse the device configuration once for the whole run
+        if snapshot is None:
+            snapshot = await asyncio.to_thread(load_snapshot)
+        if snapshot.digest is None:
+            if run.previous_dirs[TELEGRAF] is not None:
+                # Publishing would remove every device
+                raise ConfigurationError("Device configuration could not be loaded")
+
+            # Without a live generation Telegraf never starts, so publish
+            # one with the base outputs until the configuration is fixed
+            logger.warning(
+                "Device configuration could not be loaded, publishing base configuration only"
+            )
+            await DeviceService._create_base_telegraf_config(run)
+            await DeviceService._create_base_prometheus_rules(run)
+            return {SKIPPED: 0, REGENERATED: 0, FAILED: 0}
+
+        # Removed devices are left out of the new generation
+        DeviceService._log_removed_devices(run, snapshot.device_names())
 
         # Export tokens for devices that need authentication
-        DeviceService._export_tokens()
+        await DeviceService._export_tokens(snapshot)
 
         # Create base telegraf config
-        DeviceService._create_base_telegraf_config()
+        await DeviceService._create_base_telegraf_config(run)
+
+        # Create the recording rules shared by all devices
+        await DeviceService._create_base_prometheus_rules(run)
+
+        # Process devices concurrently, bounded by the global limit
+        devices = snapshot.devices()
+        semaphore = asyncio.Semaphore(max(1, settings.max_concurrent_devices))
+        results = await asyncio.gather(
+            *(
+                DeviceService._process_device_limited(device, run, semaphore, only)
+                for device in devices
+            ),
+            return_exceptions=True,
+        )
 
-        # Process each device
-        devices = get_devices()
-        successful_devices = 0
-        failed_devices = 0
+        counts = {SKIPPED: 0, REGENERATED: 0, FAILED: 0}
 
-        for device in devices:
-            try:
-                if await DeviceService._process_device(device):
-                    successful_devices += 1
-                else:
-                    failed_devices += 1
-            except Exception as e:
-                logger.error(
-                    f"Error processing device {device.get('name', 'unknown')}: {str(e)}"
-                )
-                failed_devices += 1
+        for device, result in zip(devices, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error processing device {device.name}: {str(result)}")
+                result = FAILED
+            counts[result] += 1
 
-        logger.info(
-            f"Device processing complete. Successful: {successful_devices}, Failed: {failed_devices}"
-        )
-        return {"successful": successful_devices, "failed": failed_devices}
+        # Devices with an invalid configuration keep their last good outputs
+        for device_name in snapshot.invalid_devices():
+            await DeviceService._keep_previous_outputs(run, device_name)
+            counts[FAILED] += 1
+
+        # Type dashboards need the metrics of every device of the type
+        if settings.dashboard_mode == "type":
+            await DeviceService._create_type_outputs(run)
+        elif settings.dashboard_mode not in DASHBOARD_MODES:
+            logger.warning(
+                f"Unknown DASHBOARD_MODE '{settings.dashboard_mode}', using device"
+            )
+
+        return counts
+
+    @staticmethod
+    async def rollback(generation: Optional[str] = None) -> str:
+        """Make a previous generation of configurations and dashboards live"""
+        async with _generation_lock:
+            generation = await asyncio.to_thread(rollback, generation)
+            await DeviceService._reload_prometheus()
+            return generation
+
+    @staticmethod
+    async def list_generations() -> Dict[str, Any]:
+        """List the kept generations of configurations and dashboards"""
+        return await asyncio.to_thread(list_generations)
+
+    @staticmethod
+    async def _process_device_limited(
+        device: Device,
+        run: GenerationRun,
+        semaphore: asyncio.Semaphore,
+        only: Optional[Set[str]] = None,
+    ) -> str:
+        """Process a single device once a concurrency slot is available"""
+        device_name = device.name
+        if (
+            only is not None
+            and device_name not in only
+            and await run.carry_forward(device_name)
+        ):
+            return SKIPPED
+
+        async with semaphore:
+            return await DeviceService._process_device(device, run)
 
     @staticmethod
-    async def _process_device(device: AttributeDict) -> bool:
-        """Process a single device"""
-        device_name = device.get("name", "unknown")
+    async def _process_device(device: Device, run: GenerationRun) -> str:
+        """Process a single device, returning whether it was skipped, regenerated or failed"""
+        device_name = device.name
         logger.info(f"Processing device: {device_name}")
 
         try:
@@ -81,9 +207,18 @@ class DeviceService:
                 }
 
             # Mark auth failures in the device config
-            if hasattr(discovery, "auth_failed") and discovery.auth_failed:
-                device["auth_failed"] = True
-                device["auth_error"] = discovery.auth_error
+            if discovery.auth_failed:
+                device = device.model_copy(
+                    update={"auth_failed": True, "auth_error": discovery.auth_error}
+                )
+
+            # Skip generation if nothing the outputs depend on has changed
+            fingerprint = BuildManifest.fingerprint(device, api_structure)
+            if run.previous.is_current(
+                device_name, fingerprint
+            ) and await run.carry_forward(device_name):
+                logger.info(f"Configuration for {device_name} is up to date")
+                return SKIPPED
 
             # Generate Telegraf configuration
             try:
@@ -91,86 +226,138 @@ class DeviceService:
                 telegraf_config = generator.generate()
 
                 # Write to device-specific config file
-                device_conf_path = f"{settings.telegraf_dir}/{device_name}.conf"
-                os.makedirs(os.path.dirname(device_conf_path), exist_ok=True)
-                with open(device_conf_path, "w") as f:
-                    f.write(telegraf_config)
+                device_conf_path = f"telegraf.d/{device_name}.conf"
+                await run.write(TELEGRAF, device_conf_path, telegraf_config)
 
                 logger.info(f"Created Telegraf configuration for {device_name}")
 
+                outputs = {TELEGRAF: device_conf_path}
+
+                # Generate Prometheus recording rules
+                rules_generator = PrometheusRulesGenerator(device, api_structure)
+                rules_path = f"devices/{device_name}.yml"
+                await run.write(PROMETHEUS, rules_path, rules_generator.generate())
+                outputs[PROMETHEUS] = rules_path
+
+                # Keep what the dashboard of the device type is built from
+                dashboard = {
+                    "type": device.type,
+                    "metrics": dashboard_metrics(device, api_structure),
+                }
+                if settings.dashboard_mode == "type":
+                    run.manifest.record(device_name, fingerprint, outputs, dashboard)
+                    return REGENERATED
+
                 # Generate Grafana dashboard
                 try:
                     dashboard_generator = GrafanaDashboardGenerator(
                         device, api_structure
                     )
-                    dashboard = dashboard_generator.generate()
-
-                    # Save dashboard
-                    dashboard_path = f"{settings.grafana_dir}/{device_name}.json"
-                    os.makedirs(os.path.dirname(dashboard_path), exist_ok=True)
-                    dashboard_generator.save_dashboard(dashboard_path)
+                    # Build the dashboard once and write it, off the event loop
+                    dashboard_path = f"{device_name}.json"
+                    await asyncio.to_thread(
+                        dashboard_generator.save_dashboard,
+                        run.output_path(GRAFANA, dashboard_path),
+                    )
 
                     logger.info(f"Generated dashboard for {device_name}")
+                    outputs[GRAFANA] = dashboard_path
+                    run.manifest.record(device_name, fingerprint, outputs, dashboard)
                 except Exception as dash_error:
                     logger.error(
                         f"Dashboard generation failed for {device_name}: {str(dash_error)}"
                     )
+                    # Keep the previous dashboard and retry on the next run
+                    if await run.carry_forward(device_name, kinds=[GRAFANA]):
+                        outputs[GRAFANA] = run.previous.outputs(device_name)[GRAFANA]
+                    run.manifest.record(device_name, None, outputs, dashboard)
 
-                return True
+                return REGENERATED
             except Exception as config_error:
                 logger.error(
                     f"Configuration generation failed for {device_name}: {str(config_error)}"
                 )
-                return False
+                await DeviceService._keep_previous_outputs(run, device_name)
+                return FAILED
 
         except Exception as e:
             logger.error(f"Error processing device {device_name}: {str(e)}")
-            return False
+            await DeviceService._keep_previous_outputs(run, device_name)
+            return FAILED
+
+    @staticmethod
+    async def _create_type_outputs(run: GenerationRun) -> None:
+        """Create the dashboard and rules of each device type, from the metrics of its devices"""
+        device_types: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        for device_name, dashboard in run.manifest.dashboards().items():
+            device_types.setdefault(dashboard["type"], {})[device_name] = dashboard[
+                "metrics"
+            ]
+
+        for device_type, device_metrics in sorted(device_types.items()):
+            try:
+                await run.write(
+                    PROMETHEUS,
+                    f"types/{device_type}.yml",
+                    PrometheusRulesGenerator.generate_type(device_type, device_metrics),
+                )
+            except Exception as e:
+                logger.error(
+                    f"Rules generation failed for device type {device_type}: {str(e)}"
+                )
+
+            try:
+                generator = GrafanaTypeDashboardGenerator(device_type, device_metrics)
+                await asyncio.to_thread(
+                    generator.save_dashboard,
+                    run.output_path(GRAFANA, f"types/{device_type}.json"),
+                )
+                logger.info(
+                    f"Generated dashboard for device type {device_type} ({len(device_metrics)} devices)"
+                )
+            except Exception as e:
+                logger.error(
+                    f"Dashboard generation failed for device type {device_type}: {str(e)}"
+                )
 
     @staticmethod
-    async def _cleanup_removed_devices(current_device_names: Set[str]) -> None:
-        """Clean up configurations for removed devices"""
+    async def _keep_previous_outputs(run: GenerationRun, device_name: str) -> None:
+        """Carry the last good outputs of a failed device into the new generation"""
         try:
-            # Clean up Telegraf configs
-            if os.path.exists(settings.telegraf_dir):
-                for config_file in os.listdir(settings.telegraf_dir):
-                    if config_file.endswith(".conf") and config_file != "telegraf.conf":
-                        device_name = config_file.replace(".conf", "")
-                        if device_name not in current_device_names:
-                            logger.info(
-                                f"Removing configuration for removed device: {device_name}"
-                            )
-                            os.remove(os.path.join(settings.telegraf_dir, config_file))
-
-            # Clean up Grafana dashboards
-            if os.path.exists(settings.grafana_dir):
-                for dashboard_file in os.listdir(settings.grafana_dir):
-                    if dashboard_file.endswith(".json"):
-                        device_name = dashboard_file.replace(".json", "")
-                        if (
-                            device_name not in current_device_names
-                            and device_name not in ["default", "welcome"]
-                        ):
-                            logger.info(
-                                f"Removing dashboard for removed device: {device_name}"
-                            )
-                            os.remove(
-                                os.path.join(settings.grafana_dir, dashboard_file)
-                            )
+            if await run.carry_forward(device_name):
+                logger.info(f"Keeping previous configuration for {device_name}")
         except Exception as e:
-            logger.error(f"Error cleaning up removed devices: {str(e)}")
+            logger.error(
+                f"Error keeping previous configuration for {device_name}: {str(e)}"
+            )
 
     @staticmethod
-    def _export_tokens() -> None:
+    def _log_removed_devices(
+        run: GenerationRun, current_device_names: Set[str]
+    ) -> None:
+        """
+        Log the devices of the live generation that are no longer configured
+
+        Nothing is deleted: outputs are only carried forward for configured
+        devices, so removed devices disappear once the run is published.
+        """
+        for device_name in run.previous.entries:
+            if device_name not in current_device_names:
+                logger.info(
+                    f"Leaving out configuration of removed device: {device_name}"
+                )
+
+    @staticmethod
+    async def _export_tokens(snapshot: ConfigSnapshot) -> None:
         """Export authentication tokens for devices"""
         try:
             logger.info("Exporting authentication tokens for devices...")
 
             # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(settings.token_env_path), exist_ok=True)
+            os.makedirs(settings.token_dir, exist_ok=True)
 
-            exporter = TokenExporter(settings.config_path, settings.token_env_path)
-            if exporter.run():
+            exporter = TokenExporter(settings.config_path, snapshot)
+            if await exporter.run():
                 logger.info("Successfully exported device tokens")
             else:
                 logger.warning("Failed to export some device tokens")
@@ -178,7 +365,7 @@ class DeviceService:
             logger.error(f"Error exporting authentication tokens: {str(e)}")
 
     @staticmethod
-    def _create_base_telegraf_config() -> None:
+    async def _create_base_telegraf_config(run: GenerationRun) -> None:
         """Create a base telegraf.conf with system metrics"""
         try:
             base_config = """# Telegraf Configuration - Minimal version
@@ -219,10 +406,35 @@ class DeviceService:
 [[inputs.internal]]
   collect_memstats = true
 """
-            os.makedirs(settings.telegraf_dir, exist_ok=True)
-            with open(f"{settings.telegraf_dir}/telegraf.conf", "w") as f:
-                f.write(base_config)
+            await run.write(TELEGRAF, "telegraf.conf", base_config)
 
             logger.info("Created base telegraf.conf with system metrics")
         except Exception as e:
             logger.error(f"Error creating base telegraf config: {str(e)}")
+            # A generation without the base config would break Telegraf
+            raise
+
+    @staticmethod
+    async def _create_base_prometheus_rules(run: GenerationRun) -> None:
+        """Create the health recording rules shared by all devices"""
+        try:
+            await run.write(
+                PROMETHEUS, "api-monitor.yml", PrometheusRulesGenerator.generate_base()
+            )
+            logger.info("Created base Prometheus recording rules")
+        except Exception as e:
+            logger.error(f"Error creating base Prometheus rules: {str(e)}")
+            # The dashboards query the recorded health series
+            raise
+
+    @staticmethod
+    async def _reload_prometheus() -> None:
+        """Ask Prometheus to load the live recording rules"""
+        if not settings.prometheus_reload_url:
+            return
+        try:
+            response = await http_pool.request("POST", settings.prometheus_reload_url)
+            response.raise_for_status()
+            logger.info("Reloaded Prometheus recording rules")
+        except Exception as e:
+            logger.error(f"Error reloading Prometheus: {str(e)}")
@@ -0,0 +1,433 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from app.core.config import settings
+from app.core.device_model import ApiConfig, Device
+from app.core.http_pool import http_pool
+from app.core.token_files import (
+    remove_token_file,
+    token_file_devices,
+    write_token_file,
+)
+from app.core.token_store import token_store
+
+logger = logging.getLogger("api-monitor.token-broker")
+
+
+class _Token:
+    """A cached token together with what is needed to renew it"""
+
+    __slots__ = ("device", "access_token", "expires_at", "refresh_token", "last_used")
+
+    def __init__(
+        self,
+        device: Device,
+        access_token: str,
+        expires_at: float,
+        refresh_token: Optional[str] = None,
+    ):
+        self.device = device
+        self.access_token = access_token
+        self.expires_at = expires_at
+        self.refresh_token = refresh_token
+        self.last_used = time.monotonic()
+
+
+class TokenBroker:
+    """
+    Process-wide cache of device authentication tokens
+
+    Tokens are cached in memory per set of credentials, so the token
+    exporter and API discovery share one login per device, and devices
+    behind the same identity provider with the same credentials share one
+    token. Concurrent requests for the same credentials wait for a single
+    login. A background loop renews tokens shortly before they expire,
+    using the OpenID Connect refresh token where available.
+
+    Every token is also written to a token file per device, which the
+    generated Telegraf configurations reference, so Telegraf picks up
+    renewed tokens without a restart.
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, _Token] = {}
+        # Devices using each token, the token each device uses, and the
+        # token last written for each device
+        self._devices: Dict[str, Set[str]] = {}
+        self._device_keys: Dict[str, str] = {}
+        self._written: Dict[str, str] = {}
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def get_token(self, device: Device) -> Optional[str]:
+        """Get a valid token for a token_from_auth device, logging in if needed"""
+        if device.api.auth_type != "token_from_auth":
+            return None
+        if device.api.auth_endpoint is None:
+            logger.error(f"Missing auth_endpoint for device {device.name}")
+            return None
+
+        key = self._credentials_key(device.api)
+        self._register(device.name, key)
+        token = self._tokens.get(key)
+        if token is None or not self._is_fresh(token):
+            try:
+                token = await self._single_flight(key, device)
+            except Exception as e:
+                logger.error(f"Error getting auth token for {device.name}: {str(e)}")
+                return None
+            if token is None:
+                return None
+
+        token.last_used = time.monotonic()
+        await self._write_token_files(key, token)
+        return token.access_token
+
+    def start(self) -> None:
+        """Start renewing tokens in the background"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        """Stop the background renewal"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def retain(self, device_names: Set[str]) -> None:
+        """
+        Forget the devices that no longer need a token
+
+        Their cached tokens are released once no device uses them, and
+        their token files are removed, so no live token is left on disk.
+        """
+        for device_name in list(self._device_keys):
+            if device_name not in device_names:
+                self._release(device_name)
+                self._written.pop(device_name, None)
+
+        for device_name in await asyncio.to_thread(token_file_devices):
+            if device_name not in device_names:
+                try:
+                    await asyncio.to_thread(remove_token_file, device_name)
+                except Exception as e:
+                    logger.error(
+                        f"Error removing token file for {device_name}: {str(e)}"
+                    )
+
+    async def refresh_due(self) -> None:
+        """Renew tokens that expire within the refresh margin"""
+        now = time.monotonic()
+        # Forget tokens no device asked for in two refresh intervals
+        unused = [
+            key
+            for key, token in self._tokens.items()
+            if now - token.last_used > 2 * settings.refresh_interval
+        ]
+        for key in unused:
+            del self._tokens[key]
+            for device_name in self._devices.pop(key, ()):
+                if self._device_keys.get(device_name) == key:
+                    del self._device_keys[device_name]
+
+        due = [
+            (key, token)
+            for key, token in self._tokens.items()
+            if not self._is_fresh(token)
+        ]
+        results = await asyncio.gather(
+            *(self._single_flight(key, token.device, token) for key, token in due),
+            return_exceptions=True,
+        )
+        for (_, token), result in zip(due, results):
+            if isinstance(result, Exception):
+                logger.error(
+                    f"Error renewing auth token for {token.device.name}: {str(result)}"
+                )
+
+    async def _refresh_loop(self) -> None:
+        """Periodically renew tokens before they expire"""
+        while True:
+            await asyncio.sleep(settings.token_refresh_check_interval)
+            try:
+                await self.refresh_due()
+            except Exception as e:
+                logger.error(f"Error renewing auth tokens: {str(e)}")
+
+    def _register(self, device_name: str, key: str) -> None:
+        """Record the credentials a device uses, releasing its previous ones"""
+        previous = self._device_keys.get(device_name)
+        if previous is not None and previous != key:
+            self._release(device_name)
+            self._written.pop(device_name, None)
+        self._device_keys[device_name] = key
+        self._devices.setdefault(key, set()).add(device_name)
+
+    def _release(self, device_name: str) -> None:
+        """Stop tracking the credentials of a device, dropping unused tokens"""
+        key = self._device_keys.pop(device_name, None)
+        devices = self._devices.get(key)
+        if devices is not None:
+            devices.discard(device_name)
+            if not devices:
+                # No device needs the token anymore
+                del self._devices[key]
+                self._tokens.pop(key, None)
+
+    @staticmethod
+    def _is_fresh(token: _Token) -> bool:
+        return token.expires_at > time.time() + settings.token_refresh_margin
+
+    async def _single_flight(
+        self, key: str, device: Device, previous: Optional[_Token] = None
+    ) -> Optional[_Token]:
+        """Run one login per set of credentials, shared by concurrent callers"""
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key, device, previous))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(
+        self, key: str, device: Device, previous: Optional[_Token]
+    ) -> Optional[_Token]:
+        """Obtain a new token and cache it"""
+        if device.api.auth_type_extension == "openid_connect":
+            token = await self._get_openid_token(device, previous)
+        else:
+            token = await self._get_auth_token(device)
+        if token is not None:
+            if previous is not None:
+                token.last_used = previous.last_used
+            if key not in self._devices:
+                # The credentials changed while logging in
+                return token
+            self._tokens[key] = token
+            await self._write_token_files(key, token)
+        return token
+
+    async def _write_token_files(self, key: str, token: _Token) -> None:
+        """Write a token to the token file of every device using it"""
+        for device_name in sorted(self._devices.get(key, ())):
+            if self._written.get(device_name) == token.access_token:
+                continue
+            try:
+                await asyncio.to_thread(
+                    write_token_file, device_name, token.access_token
+                )
+                self._written[device_name] = token.access_token
+            except Exception as e:
+                logger.error(f"Error writing token file for {device_name}: {str(e)}")
+
+    @staticmethod
+    def _credentials_key(api_config: ApiConfig) -> str:
+        """Identify the login a device needs, without keeping its secrets"""
+        credentials = {
+            field: getattr(api_config, field)
+            for field in (
+                "base_url",
+                "auth_endpoint",
+                "auth_method",
+                "auth_type_extension",
+                "auth_payload",
+                "username",
+                "token_path",
+                "openid_client_id",
+                "openid_scope",
+                "verify_ssl",
+            )
+        }
+        # ${VAR} references are resolved so that rotating a secret changes the key
+        credentials["password"] = api_config.resolved_password
+        credentials["token"] = api_config.resolved_token
+        encoded = json.dumps(credentials, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _extract_nested_value(data, path):
+        """Extract a value from nested JSON using a dot-separated path"""
+        current = data
+        for part in path.split("."):
+            if isinstance(current, dict) and part in current:
+                current = current[part]
+            else:
+                return None
+        return current
+
+    async def _get_auth_token(self, device: Device) -> Optional[_Token]:
+        """Log in with username and password"""
+        api_config = device.api
+        base_url = api_config.base_url
+        auth_endpoint = api_config.auth_endpoint
+        auth_method = api_config.auth_method
+        username = api_config.username
+        password = api_config.resolved_password
+        if not password:
+            logger.error(f"No password available for device {device.name}")
+            return None
+
+        # Prepare auth payload based on config
+        auth_payload = dict(api_config.auth_payload)
+
+        # If auth_payload doesn't specify username/password fields, use defaults
+        if not auth_payload:
+            auth_payload = {"username": username, "password": password}
+        else:
+            # Replace template placeholders in the payload
+            for field, value in auth_payload.items():
+                if value == "{{username}}":
+                    auth_payload[field] = username
+                elif value == "{{password}}":
+                    auth_payload[field] = password
+
+        # Make the auth request
+        url = f"{base_url.rstrip('/')}/{auth_endpoint.lstrip('/')}"
+        logger.info(f"Getting auth token for {device.name} from {url}")
+
+        verify_ssl = api_config.verify_ssl
+        if auth_method.upper() == "POST":
+            response = await http_pool.request(
+                "POST", url, verify_ssl=verify_ssl, json=auth_payload
+            )
+        else:
+            response = await http_pool.request(
+                "GET", url, verify_ssl=verify_ssl, params=auth_payload
+            )
+        response.raise_for_status()
+
+        # Extract token based on the path specified in config
+        data = response.json()
+        token_path = api_config.token_path
+        access_token = self._extract_nested_value(data, token_path)
+        if not access_token:
+            logger.error(
+                f"Could not extract token from response using path '{token_path}'"
+            )
+            return None
+
+        expires_in = data.get("expires_in") if isinstance(data, dict) else None
+        if not isinstance(expires_in, (int, float)):
+            expires_in = settings.token_ttl
+
+        logger.info(f"Successfully obtained auth token for {device.name}")
+        return _Token(device, access_token, time.time() + expires_in)
+
+    async def _get_openid_token(
+        self, device: Device, previous: Optional[_Token]
+    ) -> Optional[_Token]:
+        """Get or refresh a token using the OpenID Connect flow"""
+        device_name = device.name
+        # Prefer the refresh token of the cached or persisted token
+        await token_store.load()
+        token_data = token_store.get(device_name) or {}
+        refresh_token = previous.refresh_token if previous else None
+        if previous is None and token_data:
+            if (
+                token_data.get("expires_at", 0)
+                > time.time() + settings.token_refresh_margin
+            ):
+                logger.info(
+                    f"Using existing valid OpenID Connect access token for {device_name}"
+                )
+                return _Token(
+                    device,
+                    token_data["access_token"],
+                    token_data["expires_at"],
+                    token_data.get("refresh_token"),
+                )
+            refresh_token = token_data.get("refresh_token")
+
+        if refresh_token:
+            try:
+                return await self._request_openid_token(
+                    device,
+                    {"grant_type": "refresh_token", "refresh_token": refresh_token},
+                    refresh_token,
+                )
+            except Exception as e:
+                logger.error(f"Error refreshing token: {str(e)}")
+                logger.info("Token refresh failed, reverting to full authentication")
+
+        return await self._request_openid_token(
+            device,
+            {
+                "username": device.api.username,
+                "password": device.api.resolved_password,
+                "grant_type": "password",
+                "scope": device.api.openid_scope,
+            },
+        )
+
+    async def _request_openid_token(
+        self,
+        device: Device,
+        grant: Dict[str, str],
+        refresh_token: Optional[str] = None,
+    ) -> Optional[_Token]:
+        """Request a token from the OpenID Connect token endpoint"""
+        api_config = device.api
+        device_name = device.name
+        client_id = api_config.openid_client_id
+        token_url = (
+            f"{api_config.base_url.rstrip('/')}/{api_config.auth_endpoint.lstrip('/')}"
+        )
+
+        if grant["grant_type"] == "refresh_token":
+            logger.info(f"Refreshing access token for {device_name}")
+        else:
+            logger.info(
+                f"Getting OpenID Connect token for {device_name} from {token_url}"
+            )
+
+        response = await http_pool.request(
+            "POST",
+            token_url,
+            verify_ssl=api_config.verify_ssl,
+            data={"client_id": client_id, **grant},
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+        )
+        response.raise_for_status()
+
+        token_data = response.json()
+        access_token = token_data.get("access_token")
+        if not access_token:
+            logger.error(
+                f"No access token found in OpenID Connect response for {device_name}"
+            )
+            return None
+
+        # Keep the old refresh token if the provider does not rotate it
+        token = _Token(
+            device,
+            access_token,
+            time.time() + token_data.get("expires_in", 300),  # Default 5 minutes
+            token_data.get("refresh_token", refresh_token),
+        )
+
+        # Persist the tokens so they survive a restart
+        token_store.set(
+            device_name,
+            {
+                "access_token": token.access_token,
+                "refresh_token": token.refresh_token,
+                "expires_at": token.expires_at,
+                "token_url": token_url,
+                "client_id": client_id,
+            },
+        )
+
+        logger.info(f"Successfully obtained OpenID Connect tokens for {device_name}")
+        return token
+
+
+# Initialize the shared broker
+token_broker = TokenBroker()
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import random
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Set
+
+from app.core.bounded_json import SHORT_STRING_LENGTH
+from app.core.config import settings
+
+logger = logging.getLogger("api-monitor.structure-analyzer")
+
+# Nesting depth from which a response needs special handling in Telegraf
+DEEP_NESTING_DEPTH = 5
+
+
+class JsonAnalysis(NamedTuple):
+    """Metrics, tags and nesting depth found in a JSON document"""
+
+    metrics: List[Dict[str, Any]]
+    tags: List[Dict[str, Any]]
+    depth: int
+
+    @property
+    def is_deeply_nested(self) -> bool:
+        """Whether the document would benefit from special handling"""
+        return self.depth >= DEEP_NESTING_DEPTH
+
+    def copy(self) -> "JsonAnalysis":
+        """Copy the descriptors so callers can own them"""
+        return JsonAnalysis(
+            [dict(metric) for metric in self.metrics],
+            [dict(tag) for tag in self.tags],
+            self.depth,
+        )
+
+
+# Analyses keyed by structural fingerprint, most recently used last
+_analysis_cache: "OrderedDict[str, JsonAnalysis]" = OrderedDict()
+_analysis_cache_lock = threading.Lock()
+
+
+class _Observations(NamedTuple):
+    """What a walk over a JSON document saw, before it is described"""
+
+    # Value kinds per object member path, in document order
+    kinds: Dict[str, Dict[str, int]]
+    # Number of objects visited per path, to know how many could hold a field
+    objects_seen: Dict[str, int]
+    parents: Dict[str, str]
+    depth: int
+
+    def fingerprint(self) -> str:
+        """
+        Hash the observed shape of the document
+
+        The observations hold keys, value kinds and nesting, but not the
+        values themselves, so the fingerprint changes only when the
+        analysis result could change. Hashing them costs one entry per
+        distinct path rather than one per value.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(self.depth).encode("utf-8"))
+        for path, kinds in self.kinds.items():
+            parent = self.parents[path]
+            digest.update(
+                repr(
+                    (path, parent, sorted(kinds.items()), self.objects_seen.get(parent))
+                ).encode("utf-8", "surrogatepass")
+            )
+        return digest.hexdigest()
+
+
+def analyze_json(data: Any, fingerprint: Optional[str] = None) -> JsonAnalysis:
+    """
+    Analyze a JSON document to identify metrics and tags
+
+    The document is walked once. The resulting descriptors are cached by
+    the fingerprint of what the walk observed, so identical payload shapes
+    (for example from devices of the same type) share one analysis. A
+    fingerprint of the document's shape recorded while parsing it skips
+    the walk altogether for shapes analyzed before.
+    """
+    if fingerprint is not None:
+        analysis = _cached_analysis(fingerprint)
+        if analysis is not None:
+            return analysis.copy()
+
+    observations = _observe(data)
+    if fingerprint is None:
+        fingerprint = observations.fingerprint()
+        analysis = _cached_analysis(fingerprint)
+    if analysis is None:
+        analysis = _describe_observations(observations)
+        with _analysis_cache_lock:
+            _analysis_cache[fingerprint] = analysis
+            while len(_analysis_cache) > settings.analysis_cache_size:
+                _analysis_cache.popitem(last=False)
+    return analysis.copy()
+
+
+def _cached_analysis(fingerprint: str) -> Optional[JsonAnalysis]:
+    """Get a cached analysis, marking it most recently used"""
+    with _analysis_cache_lock:
+        analysis = _analysis_cache.get(fingerprint)
+        if analysis is not None:
+            _analysis_cache.move_to_end(fingerprint)
+    return analysis
+
+
+def sample_items(items: List[Any]) -> List[Any]:
+    """
+    Pick up to ARRAY_SAMPLE_SIZE array elements uniformly at random
+
+    The cost is independent of the array length. The choice is seeded by
+    the length, so the same payload is always sampled the same way and
+    repeated runs produce identical results.
+    """
+    size = max(1, settings.array_sample_size)
+    if len(items) <= size:
+        return items
+    indices = random.Random(len(items)).sample(range(len(items)), size)
+    return [items[index] for index in sorted(indices)]
+
+
+def _value_kind(value: Any) -> str:
+    """Classify a value the way the analysis treats it"""
+    if isinstance(value, (int, float)):
+        return "float" if isinstance(value, float) else "int"
+    if isinstance(value, str):
+        return "str" if len(value) < SHORT_STRING_LENGTH else "long_str"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, list):
+        return "array"
+    if value is None:
+        return "null"
+    return "other"
+
+
+def _observe(data: Any) -> _Observations:
+    """
+    Walk a JSON document once, without recursion
+
+    Arrays are analyzed from a bounded sample of their elements, merged
+    into one schema: fields only present in some elements are kept, and
+    each field inside an array records how often it occurs and any
+    conflicting value types.
+    """
+    # Value kinds observed per object member path, in document order
+    observations: Dict[str, Dict[str, int]] = {}
+    # Number of objects visited per path, to know how many could hold a field
+    objects_seen: Dict[str, int] = {}
+    parents: Dict[str, str] = {}
+    max_depth = 0
+
+    # Entries are (value, path, parent_path, depth, is_object_member)
+    stack = [(data, "", None, 0, False)]
+
+    while stack:
+        value, path, parent, depth, is_member = stack.pop()
+        if depth > max_depth:
+            max_depth = depth
+
+        if is_member:
+            kinds = observations.get(path)
+            if kinds is None:
+                kinds = observations[path] = {}
+                parents[path] = parent
+            kind = _value_kind(value)
+            kinds[kind] = kinds.get(kind, 0) + 1
+
+        if isinstance(value, dict):
+            objects_seen[path] = objects_seen.get(path, 0) + 1
+            prefix = f"{path}." if path else ""
+            stack.extend(
+                (child, f"{prefix}{key}", path, depth + 1, True)
+                for key, child in reversed(value.items())
+            )
+        elif isinstance(value, list):
+            item_path = f"{path}[*]"
+            stack.extend(
+                (item, item_path, path, depth + 1, False)
+                for item in reversed(sample_items(value))
+            )
+
+    return _Observations(observations, objects_seen, parents, max_depth)
+
+
+def _describe_observations(observations: _Observations) -> JsonAnalysis:
+    """Turn the observations of a walk into metric and tag descriptors"""
+    metrics = []
+    tags = []
+
+    for path, kinds in observations.kinds.items():
+        descriptor = _describe(path, kinds, metrics, tags)
+        # Fields inside arrays come from several sampled elements
+        if descriptor is not None and "[*]" in path:
+            descriptor["occurrences"] = sum(kinds.values())
+            descriptor["samples"] = observations.objects_seen.get(
+                observations.parents[path], 0
+            )
+
+    return JsonAnalysis(metrics, tags, observations.depth)
+
+
+def _describe(
+    path: str,
+    kinds: Dict[str, int],
+    metrics: List[Dict[str, Any]],
+    tags: List[Dict[str, Any]],
+) -> Optional[Dict[str, Any]]:
+    """Add the metric or tag descriptor for a field from its value kinds"""
+    numbers = kinds.get("int", 0) + kinds.get("float", 0)
+    strings = kinds.get("str", 0)
+    if numbers == 0 and strings == 0:
+        return None
+
+    if numbers >= strings:
+        descriptor = {
+            "path": path,
+            "name": path.replace(".", "_"),
+            "type": "float" if "float" in kinds else "int",
+        }
+        metrics.append(descriptor)
+    else:
+        descriptor = {"path": path, "name": path.replace(".", "_")}
+        tags.append(descriptor)
+
+    if len(kinds) > 1:
+        descriptor["type_conflicts"] = dict(kinds)
+    return descriptor
+
+
+# Value kinds of the JSON Schema primitive types, booleans count as integers
+# just like sampled values
+_SCHEMA_KINDS = {
+    "integer": "int",
+    "number": "float",
+    "boolean": "int",
+    "string": "str",
+    "object": "object",
+    "array": "array",
+    "null": "null",
+}
+
+_JSON_MEDIA_TYPES = ("application/json", "application/problem+json", "*/*")
+
+
+class _SchemaShape(NamedTuple):
+    """Flattened shape of a schema: its own kinds, member fields and depth"""
+
+    kinds: Dict[str, int]
+    # Value kinds per member path, relative to the schema
+    fields: Dict[str, Dict[str, int]]
+    depth: int
+    # Whether a reference cycle was cut short while building the shape
+    cyclic: bool
+
+
+def _join_path(prefix: str, suffix: str) -> str:
+    """Join a relative member path onto a prefix"""
+    if not prefix or suffix.startswith("["):
+        return f"{prefix}{suffix}"
+    return f"{prefix}.{suffix}"
+
+
+def _merge_kinds(target: Dict[str, int], kinds: Dict[str, int]) -> None:
+    for kind, count in kinds.items():
+        target[kind] = target.get(kind, 0) + count
+
+
+class SchemaIndex:
+    """
+    Index over the schemas of an OpenAPI/Swagger specification
+
+    Resolves local $ref pointers, allOf/oneOf/anyOf compositions and
+    Swagger 2 or OpenAPI 3 response schemas, and derives the same metric
+    and tag descriptors that analyze_json finds in a sampled response.
+    Resolved references and their shapes are memoized, so schemas shared
+    by many operations are only walked once. Reference cycles are cut
+    where they recur.
+    """
+
+    def __init__(self, spec: Dict[str, Any]):
+        self.spec = spec
+        self._refs: Dict[str, Any] = {}
+        self._shapes: Dict[str, _SchemaShape] = {}
+
+    def resolve(self, node: Any, seen: Optional[Set[str]] = None) -> Any:
+        """Follow $ref pointers until a concrete node is reached"""
+        seen = set() if seen is None else seen
+        while isinstance(node, dict) and isinstance(node.get("$ref"), str):
+            ref = node["$ref"]
+            if ref in seen:
+                return {}
+            seen.add(ref)
+            node = self._lookup(ref)
+        return node
+
+    def _lookup(self, ref: str) -> Any:
+        """Look up a local JSON pointer, such as #/components/schemas/Pet"""
+        if ref not in self._refs:
+            node: Any = None
+            if ref.startswith("#"):
+                node = self.spec
+                for token in ref[1:].split("/")[1:]:
+                    token = token.replace("~1", "/").replace("~0", "~")
+                    if isinstance(node, dict):
+                        node = node.get(token)
+                    elif isinstance(node, list) and token.isdigit():
+                        index = int(token)
+                        node = node[index] if index < len(node) else None
+                    else:
+                        node = None
+                        break
+            if node is None:
+                logger.debug(f"Unresolvable schema reference {ref}")
+            self._refs[ref] = {} if node is None else node
+        return self._refs[ref]
+
+    def response_schema(self, operation: Dict[str, Any]) -> Optional[Any]:
+        """Get the schema of the first success response of an operation"""
+        responses = operation.get("responses") or {}
+        for status, response in responses.items():
+            if not str(status).startswith("2"):
+                continue
+            response = self.resolve(response)
+            if not isinstance(response, dict):
+                continue
+
+            # Swagger 2
+            if "schema" in response:
+                return response["schema"]
+
+            # OpenAPI 3
+            content = response.get("content") or {}
+            media_types = [m for m in _JSON_MEDIA_TYPES if m in content] + [
+                m for m in content if "json" in m and m not in _JSON_MEDIA_TYPES
+            ]
+            for media_type in media_types:
+                media = content[media_type]
+                if isinstance(media, dict) and "schema" in media:
+                    return media["schema"]
+        return None
+
+    def analyze(self, schema: Any) -> JsonAnalysis:
+        """Derive metric and tag descriptors from a schema"""
+        shape = self._shape(schema, set())
+        metrics = []
+        tags = []
+        for path, kinds in shape.fields.items():
+            _describe(path, kinds, metrics, tags)
+        return JsonAnalysis(metrics, tags, shape.depth)
+
+    def _shape(self, schema: Any, active: Set[str]) -> _SchemaShape:
+        """Flatten a schema, memoizing referenced schemas"""
+        if isinstance(schema, dict) and isinstance(schema.get("$ref"), str):
+            ref = schema["$ref"]
+            shape = self._shapes.get(ref)
+            if shape is not None:
+                return shape
+            if ref in active:
+                return _SchemaShape({}, {}, 0, True)
+
+            active.add(ref)
+            try:
+                shape = self._shape(self._lookup(ref), active)
+            finally:
+                active.discard(ref)
+            # Shapes cut short by a cycle depend on where they were entered
+            if not shape.cyclic:
+                self._shapes[ref] = shape
+            return shape
+
+        if not isinstance(schema, dict):
+            return _SchemaShape({}, {}, 0, False)
+
+        kinds: Dict[str, int] = {}
+        fields: Dict[str, Dict[str, int]] = {}
+        depth = 0
+        cyclic = False
+
+        def add_fields(prefix: str, shape: _SchemaShape) -> None:
+            for path, field_kinds in shape.fields.items():
+                _merge_kinds(
+                    fields.setdefault(_join_path(prefix, path), {}), field_kinds
+                )
+
+        declared = schema.get("type")
+        if isinstance(declared, list):
+            declared = [t for t in declared if t != "null"][:1] or ["null"]
+            declared = declared[0]
+        if declared in _SCHEMA_KINDS:
+            kinds[_SCHEMA_KINDS[declared]] = 1
+        elif "properties" in schema:
+            kinds["object"] = 1
+        elif "items" in schema:
+            kinds["array"] = 1
+        elif "enum" in schema and schema["enum"]:
+            kinds[_value_kind(schema["enum"][0])] = 1
+
+        properties = schema.get("properties")
+        if isinstance(properties, dict):
+            for name, child in properties.items():
+                shape = self._shape(child, active)
+                cyclic = cyclic or shape.cyclic
+                _merge_kinds(fields.setdefault(name, {}), shape.kinds)
+                add_fields(name, shape)
+                depth = max(depth, shape.depth + 1)
+
+        items = schema.get("items")
+        if isinstance(items, dict):
+            shape = self._shape(items, active)
+            cyclic = cyclic or shape.cyclic
+            add_fields("[*]", shape)
+            depth = max(depth, shape.depth + 1)
+
+        # Compositions are merged into one schema, alternatives of oneOf and
+        # anyOf show up as type conflicts when they disagree
+        for keyword in ("allOf", "oneOf", "anyOf"):
+            for part in schema.get(keyword) or []:
+                shape = self._shape(part, active)
+                cyclic = cyclic or shape.cyclic
+                if keyword != "allOf" or not kinds:
+                    _merge_kinds(kinds, shape.kinds)
+                add_fields("", shape)
+                depth = max(depth, shape.depth)
+
+        return _SchemaShape(kinds, fields, depth, cyclic)
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
-import json
+import asyncio
 import logging
 import os
 import sys
-from pathlib import Path
 
-import requests
-import yaml
+from app.core.config import settings
+from app.core.device_config import load_snapshot
+from app.core.http_pool import http_pool
+from app.core.token_files import token_file_path
+from app.core.token_store import token_store
+from app.services.token_broker import token_broker
 
 logger = logging.getLogger("api-monitor.token-exporter")
 logging.basicConfig(
@@ -17,174 +20,96 @@ logging.basicConfig(
 
 class TokenExporter:
     """
-    Exports authentication tokens to environment variables for Telegraf to use.
-    Creates a file with environment variables that can be sourced by the shell.
+    Exports authentication tokens to token files for Telegraf to use.
+    Each device gets a file in the token directory, which the generated
+    Telegraf configuration reads on every request as its bearer token.
     """
 
-    def __init__(self, config_path, output_path):
+    def __init__(self, config_path, snapshot=None):
         self.config_path = config_path
-        self.output_path = output_path
-        self.env_vars = {}
-        self.device_config = None
+        self.tokens = {}
+        self.snapshot = snapshot
+        self.devices = None
+        self.invalid_device_names = set()
 
     def load_config(self):
-        """Load the device configuration from YAML"""
-        try:
-            with open(self.config_path, "r") as f:
-                self.device_config = yaml.safe_load(f)
-            logger.info(f"Loaded configuration from {self.config_path}")
-            return True
-        except Exception as e:
-            logger.error(f"Error loading configuration: {str(e)}")
+        """Load the device configuration, reusing a snapshot if one was given"""
+        snapshot = self.snapshot or load_snapshot(self.config_path)
+        if snapshot.digest is None:
             return False
+        self.devices = snapshot.devices()
+        self.invalid_device_names = set(snapshot.invalid_devices())
+        return True
 
-    def extract_nested_value(self, data, path):
-        """Extract a value from nested JSON using a dot-separated path"""
-        parts = path.split(".")
-        current = data
-
-        for part in parts:
-            if isinstance(current, dict) and part in current:
-                current = current[part]
-            else:
-                return None
-
-        return current
-
-    def get_auth_token(self, device):
-        """Get authentication token for a device"""
+    async def get_auth_token(self, device):
+        """Get authentication token for a device from the shared token broker"""
         try:
-            api_config = device["api"]
-            base_url = api_config["base_url"]
-            auth_type = api_config.get("auth_type", "none")
-
-            if auth_type != "token_from_auth":
-                return None
-
-            if "auth_endpoint" not in api_config:
-                logger.error(f"Missing auth_endpoint for device {device['name']}")
-                return None
-
-            # Extract auth configuration
-            auth_endpoint = api_config["auth_endpoint"]
-            auth_method = api_config.get("auth_method", "POST")
-            username = api_config["username"]
-            password = api_config["password"]
-
-            # Handle environment variable references for password
-            if password.startswith("${") and password.endswith("}"):
-                env_var = password[2:-1]
-                password = os.environ.get(env_var, "")
-                if not password:
-                    logger.error(
-                        f"Environment variable {env_var} not set for device {device['name']}"
-                    )
-                    return None
-
-            # Prepare auth payload based on config
-            auth_payload = api_config.get("auth_payload", {})
-
-            # If auth_payload doesn't specify username/password fields, use defaults
-            if not auth_payload:
-                auth_payload = {"username": username, "password": password}
-            else:
-                # Replace template placeholders in the payload
-                for key, value in auth_payload.items():
-                    if value == "{{username}}":
-                        auth_payload[key] = username
-                    elif value == "{{password}}":
-                        auth_payload[key] = password
-
-            # Make the auth request
-            url = f"{base_url.rstrip('/')}/{auth_endpoint.lstrip('/')}"
-            logger.info(f"Getting auth token for {device['name']} from {url}")
-
-            if auth_method.upper() == "POST":
-                response = requests.post(url, json=auth_payload, timeout=10)
-            else:
-                response = requests.get(url, params=auth_payload, timeout=10)
-
-            response.raise_for_status()
-
-            # Parse response for token
-            data = response.json()
-
-            # Extract token based on the path specified in config
-            token_path = api_config.get("token_path", "token")
-            token = self.extract_nested_value(data, token_path)
-
-            if token:
-                logger.info(f"Successfully obtained auth token for {device['name']}")
-                return token
-            else:
-                logger.error(
-                    f"Could not extract token from response using path '{token_path}'"
-                )
-                return None
-
+            return await token_broker.get_token(device)
         except Exception as e:
-            logger.error(f"Error getting auth token for {device['name']}: {str(e)}")
+            logger.error(f"Error getting auth token for {device.name}: {str(e)}")
             return None
 
-    def process_devices(self):
+    async def process_devices(self):
         """Process all devices that need tokens"""
-        if not self.device_config:
+        if self.devices is None:
             logger.error("No configuration loaded")
             return False
 
-        devices = self.device_config.get("devices", [])
-
-        for device in devices:
+        # Remove the tokens of devices that were removed or stopped using
+        # token_from_auth. Invalid devices keep their previous configuration,
+        # which still reads their token file.
+        await token_broker.retain(
+            {
+                device.name
+                for device in self.devices
+                if device.api.auth_type == "token_from_auth"
+            }
+            | self.invalid_device_names
+        )
+
+        for device in self.devices:
             try:
-                if (
-                    "api" in device
-                    and device["api"].get("auth_type") == "token_from_auth"
-                ):
-                    token = self.get_auth_token(device)
+                if device.api.auth_type == "token_from_auth":
+                    # The broker writes the token file as it obtains the token
+                    token = await self.get_auth_token(device)
                     if token:
-                        env_var_name = f"DEVICE_{device['name'].upper()}_TOKEN"
-                        self.env_vars[env_var_name] = token
-                        logger.info(f"Set token for {device['name']} in {env_var_name}")
+                        self.tokens[device.name] = token
+                        logger.info(
+                            f"Exported token for {device.name} to {token_file_path(device.name)}"
+                        )
             except Exception as e:
-                logger.error(f"Error processing device {device['name']}: {str(e)}")
+                logger.error(f"Error processing device {device.name}: {str(e)}")
 
         return True
 
-    def write_env_file(self):
-        """Write environment variables to a file that can be sourced"""
-        if not self.env_vars:
-            logger.warning("No tokens to export")
-            return False
-
-        try:
-            with open(self.output_path, "w") as f:
-                f.write("# Generated by API Monitor - Do not edit manually\n")
-                for name, value in self.env_vars.items():
-                    f.write(f'export {name}="{value}"\n')
-
-            logger.info(f"Wrote {len(self.env_vars)} tokens to {self.output_path}")
-            return True
-        except Exception as e:
-            logger.error(f"Error writing environment file: {str(e)}")
-            return False
-
-    def run(self):
+    async def run(self):
         """Run the token exporter"""
         if not self.load_config():
             return False
 
-        if not self.process_devices():
+        if not await self.process_devices():
             return False
 
-        return self.write_env_file()
+        if not self.tokens:
+            logger.warning("No tokens to export")
+            return False
+
+        logger.info(f"Exported {len(self.tokens)} tokens to {settings.token_dir}")
+        return True
 
 
 if __name__ == "__main__":
     config_path = os.environ.get("CONFIG_PATH", "/config/devices.yml")
-    output_path = os.environ.get("TOKEN_ENV_PATH", "/config/telegraf/auth_tokens.env")
 
-    exporter = TokenExporter(config_path, output_path)
-    success = exporter.run()
+    async def main():
+        exporter = TokenExporter(config_path)
+        try:
+            return await exporter.run()
+        finally:
+            await token_store.flush()
+            await http_pool.close()
+
+    success = asyncio.run(main())
 
     if success:
         logger.info("Token export completed successfully")
@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.core.bounded_json import BoundedJsonParser, JsonLimits, read_json
+
+LIMITS = JsonLimits(max_bytes=10**7, max_depth=64, max_nodes=10**6)
+
+DOCUMENTS = [
+    {},
+    [],
+    0,
+    -12.5e-3,
+    "plain",
+    True,
+    None,
+    {"a": 1, "b": [1, 2.5, -3e10, True, False, None], "c": {"d": {"e": "f"}}},
+    [{"id": "x", "v": 1}, {"id": "y", "v": 2, "extra": [[], {}]}],
+    {"escaped": 'quote " backslash \\ slash / tab \t newline \n', "u": "é中"},
+    {"emoji": "\U0001f600", "key with spaces": "", "": 0},
+    [[[[[1]]]], [[["deep"]]]],
+]
+
+
+def _parse(text, chunk_size=None, limits=LIMITS):
+    data = text.encode("utf-8")
+    parser = BoundedJsonParser(limits)
+    if chunk_size is None:
+        parser.feed(data)
+    else:
+        for start in range(0, len(data), chunk_size):
+            parser.feed(data[start : start + chunk_size])
+    return parser.finish()
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+@pytest.mark.parametrize("indent", [None, 2])
+def test_round_trip_matches_json_loads(document, indent):
+    text = json.dumps(document, indent=indent)
+    assert _parse(text) == json.loads(text)
+
+
+@pytest.mark.parametrize("document", DOCUMENTS)
+def test_every_chunk_boundary_matches_json_loads(document):
+    text = json.dumps(document, ensure_ascii=False, indent=1)
+    data = text.encode("utf-8")
+    expected = json.loads(text)
+    for split in range(len(data) + 1):
+        parser = BoundedJsonParser(LIMITS)
+        parser.feed(data[:split])
+        parser.feed(data[split:])
+        assert parser.finish() == expected, split
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7])
+def test_small_chunks_match_json_loads(chunk_size):
+    text = json.dumps(DOCUMENTS, ensure_ascii=False)
+    assert _parse(text, chunk_size) == json.loads(text)
+
+
+@pytest.mark.parametrize("text", ["", "{", '{"a" 1}', "[1,]x", "tru", '"open', "1 2"])
+def test_invalid_documents_raise(text):
+    with pytest.raises(json.JSONDecodeError):
+        _parse(text)
+
+
+def test_containers_beyond_max_depth_are_dropped():
+    parser = BoundedJsonParser(JsonLimits(10**6, 2, 10**6))
+    parser.feed(b'{"a": {"b": {"c": 1}}, "d": 2}')
+    assert parser.finish() == {"a": {}, "d": 2}
+    assert parser.truncated
+
+
+def test_parsing_stops_at_max_nodes():
+    parser = BoundedJsonParser(JsonLimits(10**6, 64, 4))
+    parser.feed(b"[1, 2, 3, 4, 5, 6]")
+    assert parser.finish() == [1, 2, 3]
+    assert parser.truncated
+
+
+def test_partial_document_is_closed():
+    parser = BoundedJsonParser(LIMITS)
+    parser.feed(b'{"a": [1, 2, {"b": "c"}, "d"')
+    assert parser.finish(partial=True) == {"a": [1, 2, {"b": "c"}, "d"]}
+
+
+def test_number_cut_short_is_dropped():
+    # The rest of the number may have been cut off
+    parser = BoundedJsonParser(LIMITS)
+    parser.feed(b"[1, 2, 34")
+    assert parser.finish(partial=True) == [1, 2]
+
+
+def test_same_shape_has_same_fingerprint():
+    fingerprints = []
+    for document in ({"a": [1, "x"]}, {"a": [2, "y"]}, {"a": [2.5, "y"]}):
+        parser = BoundedJsonParser(LIMITS)
+        parser.feed(json.dumps(document).encode("utf-8"))
+        parser.finish()
+        fingerprints.append(parser.fingerprint())
+    assert fingerprints[0] == fingerprints[1] != fingerprints[2]
+
+
+def _read(body, limits):
+    response = httpx.Response(200, content=body)
+    return asyncio.run(read_json(response, limits))
+
+
+def test_read_json_parses_complete_bodies_with_json_loads():
+    body = json.dumps(DOCUMENTS).encode("utf-8")
+    document, truncated, fingerprint = _read(body, LIMITS)
+    assert document == json.loads(body)
+    assert not truncated
+    assert fingerprint is None
+
+
+def test_read_json_keeps_the_part_within_the_byte_limit():
+    body = json.dumps({"a": list(range(100))}).encode("utf-8")
+    document, truncated, fingerprint = _read(body, JsonLimits(20, 64, 10**6))
+    assert truncated
+    # Cut after '{"a": [0, 1, 2, 3, 4', where 4 may continue
+    assert document == {"a": [0, 1, 2, 3]}
+    assert fingerprint is not None
+
+
+def test_read_json_truncates_documents_beyond_node_limit():
+    body = json.dumps(list(range(100))).encode("utf-8")
+    document, truncated, _ = _read(body, JsonLimits(10**6, 64, 11))
+    assert truncated
+    assert document == list(range(10))